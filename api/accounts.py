@@ -0,0 +1,22 @@
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+
+
+def create_user(serializer, password):
+    """Insert the user with an already hashed password, and its token, in one transaction."""
+    with transaction.atomic():
+        user = serializer.save(password=password)
+        token = Token.objects.create(user=user)
+    return user, token
+
+
+def replace_password(user, password):
+    """Store an already hashed password and rotate the user's token."""
+    user.password = password
+    with transaction.atomic():
+        user.save(update_fields=['password'])
+        token_cache.evict_user(user)
+        Token.objects.filter(user=user).delete()
+        return Token.objects.create(user=user)
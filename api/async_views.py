@@ -0,0 +1,157 @@
+"""
+Async versions of the password hashing views, for ASGI deployments.
+
+PBKDF2 runs on a bounded thread pool (hashlib releases the GIL while
+hashing), so a burst of logins occupies at most PASSWORD_HASHING_WORKERS
+threads and the event loop keeps serving cheap endpoints in the meantime.
+"""
+import asyncio
+import functools
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from rest_framework.authentication import get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.throttling import BaseThrottle
+from rest_framework import status
+
+from .accounts import create_user, replace_password
+from .authentication import CachedTokenAuthentication
+from .serializers import UserSerializer
+from .throttling import check_login
+
+hashing_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASHING_WORKERS,
+    thread_name_prefix='password-hashing',
+)
+
+
+async def run_hashing(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hashing_executor, functools.partial(func, *args))
+
+
+def csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt wraps the view in a sync
+    # function on this Django version, which hides the coroutine.
+    view.csrf_exempt = True
+    return view
+
+
+def parse_body(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def method_not_allowed(request):
+    return JsonResponse(
+        {'detail': 'Method "{}" not allowed.'.format(request.method)},
+        status=status.HTTP_405_METHOD_NOT_ALLOWED,
+    )
+
+
+def malformed_request():
+    return JsonResponse({'detail': 'Malformed request body.'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def authenticate(request):
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != b'token':
+        raise AuthenticationFailed('Authentication credentials were not provided.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+    return CachedTokenAuthentication().authenticate_credentials(key)
+
+
+@csrf_exempt
+async def signup(request):
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    data = parse_body(request)
+    if data is None:
+        return malformed_request()
+    serializer = UserSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=status.HTTP_200_OK)
+    password = await run_hashing(make_password, serializer.validated_data['password'])
+    user, token = await sync_to_async(create_user)(serializer, password)
+    return JsonResponse({'token': token.key, 'user': serializer.data})
+
+
+@csrf_exempt
+async def login(request):
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    data = parse_body(request)
+    if data is None:
+        return malformed_request()
+    if 'username' not in data:
+        return JsonResponse({"error": "Username is required"}, status=status.HTTP_400_BAD_REQUEST)
+    if 'password' not in data:
+        return JsonResponse({"error": "Password is required"}, status=status.HTTP_400_BAD_REQUEST)
+    wait = check_login(BaseThrottle().get_ident(request), data['username'])
+    if wait:
+        response = JsonResponse(
+            {'detail': 'Request was throttled. Expected available in {} seconds.'.format(math.ceil(wait))},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+    user = await sync_to_async(User.objects.filter(username=data['username'], is_active=True).first)()
+    if user is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    # Collect a rehash request instead of letting check_password save from the pool thread.
+    rehash = []
+    valid = await run_hashing(check_password, data['password'], user.password, rehash.append)
+    if not valid:
+        return JsonResponse("error: username or password is wrong", status=status.HTTP_404_NOT_FOUND, safe=False)
+    if rehash:
+        user.password = await run_hashing(make_password, rehash[0])
+        await sync_to_async(user.save)(update_fields=['password'])
+
+    token, created = await sync_to_async(Token.objects.get_or_create)(user=user)
+    return JsonResponse({'token': token.key, 'user': UserSerializer(user).data})
+
+
+@csrf_exempt
+async def change_password(request):
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    try:
+        user, _ = await sync_to_async(authenticate)(request)
+    except AuthenticationFailed as e:
+        response = JsonResponse({'detail': e.detail}, status=status.HTTP_401_UNAUTHORIZED)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+    data = parse_body(request)
+    if data is None:
+        return malformed_request()
+    if 'old_password' not in data:
+        return JsonResponse({"error": "Old password is required"}, status=status.HTTP_400_BAD_REQUEST)
+    if 'new_password' not in data:
+        return JsonResponse({"error": "New password is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not await run_hashing(check_password, data['old_password'], user.password):
+        return JsonResponse({"error": "Old password is incorrect"}, status=status.HTTP_400_BAD_REQUEST)
+
+    password = await run_hashing(make_password, data['new_password'])
+    new_token = await sync_to_async(replace_password)(user, password)
+    return JsonResponse({
+        "message": "Password successfully changed",
+        "new_token": new_token.key
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,111 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+from .shared import get_stamps
+
+
+class TokenCache:
+    """
+    Bounded LRU of token key -> (user, token, loaded at, expiry).
+
+    Entries live for at most ``ttl`` seconds. Revocations are stamped, once
+    the token delete commits, in a table shared by every process on the host
+    (api.shared), so other workers, and management commands such as
+    purge_deleted, make the next hit on a revoked token go back to the
+    database instead of waiting for the TTL.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, token, loaded_at, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if get_stamps('revocations').get(key) >= loaded_at:
+            self.discard(key)
+            return None
+        return user, token
+
+    def set(self, key, user, token, loaded_at):
+        """Cache a token read from the database; ``loaded_at`` is time.time() from before the read."""
+        with self._lock:
+            self._entries[key] = (user, token, loaded_at, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def evict(self, key):
+        """Revoke ``key`` in every process; call it after deleting the token."""
+        self.revoke([key])
+
+    def evict_user(self, user):
+        """Revoke all of ``user``'s tokens in every process; call it before deleting them."""
+        with self._lock:
+            keys = [key for key, (cached_user, _, _, _) in self._entries.items() if cached_user.pk == user.pk]
+        # Tokens of this user that another worker may have cached.
+        from rest_framework.authtoken.models import Token
+        keys.extend(Token.objects.filter(user=user).values_list('key', flat=True))
+        self.revoke(set(keys))
+
+    def revoke(self, keys):
+        for key in keys:
+            self.discard(key)
+
+        def stamp():
+            stamps, now = get_stamps('revocations'), time.time()
+            for key in keys:
+                self.discard(key)
+                stamps.touch(key, now)
+
+        # Only once the delete is committed: a worker that loads the token
+        # before then has an older loaded_at than the stamp, and one that loads
+        # it afterwards no longer finds it.
+        transaction.on_commit(stamp)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that keeps recently seen tokens in memory, skipping the
+    token + user query on repeated requests.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            loaded_at = time.time()
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, token, loaded_at)
+        else:
+            user, token = cached
+        # Views may modify request.user, so never hand out the cached instance.
+        return copy.copy(user), token
@@ -0,0 +1,300 @@
+"""
+Endpoint benchmark behind ``manage.py benchmark``.
+
+Every route in api/urls.py has a scenario. Each scenario prepares its own
+targets (users, tokens, apps) outside the timed section, then sends requests
+through an in-process APIClient, recording latency, status codes and the
+number of SQL queries per request. Subscription events queued by earlier
+requests are flushed before each request, as the background flusher would,
+so a request is never charged for writing events that other requests queued.
+"""
+import itertools
+import math
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .bulk import bulk_create_apps
+from .history import event_buffer
+from .models import App, Plan
+from .plans import plan_catalog
+
+PASSWORD = 'benchmark-password'
+
+# Upper bound on SQL queries per request, checked by ``benchmark --check``.
+QUERY_BUDGETS = {
+    'signup': 4,
+    'login': 2,
+    'logout': 2,
+    'change_pass': 6,
+    'app_list': 3,
+    'app_list_page': 3,
+    'app_list_fields': 3,
+    'app_create': 3,
+    'app_create_idempotent': 6,
+    'app_bulk_create': 6,
+    # One query per APP_EXPORT_CHUNK_SIZE apps, so not budgeted.
+    'app_export': None,
+    'app_detail': 3,
+    'app_update': 4,
+    'app_delete': 6,
+    'app_delete_async': 4,
+    'subscription_update': 4,
+    'subscription_delete': 5,
+    'subscription_bulk_update': 6,
+    'subscription_history': 4,
+    'revenue_report': 3,
+    'metrics': 2,
+}
+
+SEED_BATCH_SIZE = 500
+
+
+def percentile(ordered, p):
+    # Nearest-rank percentile of an already sorted list.
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Request:
+    def __init__(self, method, path, data=None, token=None, headers=None):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.token = token
+        self.headers = headers or {}
+
+
+class EndpointBenchmark:
+    def __init__(self, users=10, apps_per_user=100, requests=20):
+        self.users = users
+        self.apps_per_user = apps_per_user
+        self.requests = requests
+        self.counter = itertools.count()
+        self.client = APIClient()
+
+    # Seeding
+
+    def seed(self):
+        for name, _ in Plan.PLAN_CHOICES:
+            Plan.objects.get_or_create(name=name)
+        plan_catalog.clear()
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(username='bench-{}'.format(i), password=password) for i in range(self.users)
+        ])
+        self.seeded_users = list(User.objects.filter(username__startswith='bench-').order_by('pk'))
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in self.seeded_users])
+        self.tokens = dict(Token.objects.filter(user__in=self.seeded_users).values_list('user_id', 'key'))
+        staff = User.objects.create(username='bench-staff', password=password, is_staff=True)
+        self.staff_token = Token.objects.create(user=staff).key
+        for user in self.seeded_users:
+            for start in range(0, self.apps_per_user, SEED_BATCH_SIZE):
+                count = min(SEED_BATCH_SIZE, self.apps_per_user - start)
+                bulk_create_apps(user, [
+                    {'name': 'App {}'.format(start + i), 'description': 'Seeded app'} for i in range(count)
+                ])
+
+    def seeded_user(self):
+        user = self.seeded_users[next(self.counter) % len(self.seeded_users)]
+        return user, self.tokens[user.pk]
+
+    def seeded_app(self):
+        user, token = self.seeded_user()
+        app = App.objects.filter(user=user).order_by('?').first()
+        if app is None:
+            app = bulk_create_apps(user, [{'name': 'Benchmark app', 'description': ''}])[0]
+        return app, token
+
+    def fresh_user(self):
+        user = User.objects.create(
+            username='bench-fresh-{}'.format(next(self.counter)), password=make_password(PASSWORD),
+        )
+        return user, Token.objects.create(user=user).key
+
+    # Scenarios: each returns the Request to time.
+
+    def signup(self):
+        n = next(self.counter)
+        return Request('post', '/signup', {
+            'username': 'bench-signup-{}'.format(n), 'password': PASSWORD, 'email': 'bench{}@example.com'.format(n),
+        })
+
+    def login(self):
+        user, _ = self.seeded_user()
+        return Request('post', '/login', {'username': user.username, 'password': PASSWORD})
+
+    def logout(self):
+        _, token = self.fresh_user()
+        return Request('post', '/logout', token=token)
+
+    def change_pass(self):
+        _, token = self.fresh_user()
+        return Request('post', '/change_pass', {'old_password': PASSWORD, 'new_password': PASSWORD}, token=token)
+
+    def app_list(self):
+        _, token = self.seeded_user()
+        return Request('get', '/app/', token=token)
+
+    def app_list_page(self):
+        _, token = self.seeded_user()
+        return Request('get', '/app/?page_size=100', token=token)
+
+    def app_list_fields(self):
+        _, token = self.seeded_user()
+        return Request('get', '/app/?fields=id,name', token=token)
+
+    def app_create(self):
+        _, token = self.seeded_user()
+        return Request('post', '/app/', {'name': 'Created app', 'description': 'benchmark'}, token=token)
+
+    def app_create_idempotent(self):
+        _, token = self.seeded_user()
+        return Request(
+            'post', '/app/', {'name': 'Created app', 'description': 'benchmark'}, token=token,
+            headers={'HTTP_IDEMPOTENCY_KEY': 'bench-{}'.format(next(self.counter))},
+        )
+
+    def app_bulk_create(self):
+        _, token = self.seeded_user()
+        return Request('post', '/app/bulk/', [
+            {'name': 'Bulk app {}'.format(i), 'description': 'benchmark'} for i in range(10)
+        ], token=token)
+
+    def app_export(self):
+        _, token = self.seeded_user()
+        return Request('get', '/app/export/?format=csv', token=token)
+
+    def app_detail(self):
+        app, token = self.seeded_app()
+        return Request('get', '/app/{}/'.format(app.pk), token=token)
+
+    def app_update(self):
+        app, token = self.seeded_app()
+        return Request('put', '/app/{}/'.format(app.pk), {'name': 'Updated app'}, token=token)
+
+    def app_delete(self):
+        user, token = self.seeded_user()
+        app = bulk_create_apps(user, [{'name': 'Doomed app', 'description': ''}])[0]
+        return Request('delete', '/app/{}/'.format(app.pk), token=token)
+
+    def app_delete_async(self):
+        user, token = self.seeded_user()
+        app = bulk_create_apps(user, [{'name': 'Doomed app', 'description': ''}])[0]
+        return Request('delete', '/app/{}/'.format(app.pk), token=token, headers={'HTTP_PREFER': 'respond-async'})
+
+    def subscription_update(self):
+        app, token = self.seeded_app()
+        return Request('put', '/app/sub/{}/'.format(app.pk), {'plan': 'PRO'}, token=token)
+
+    def subscription_delete(self):
+        app, token = self.seeded_app()
+        return Request('delete', '/app/sub/{}/'.format(app.pk), token=token)
+
+    def subscription_bulk_update(self):
+        user, token = self.seeded_user()
+        app_ids = list(App.objects.filter(user=user).values_list('pk', flat=True)[:50])
+        return Request('put', '/app/sub/bulk/', {'plan': 'STANDARD', 'apps': app_ids}, token=token)
+
+    def subscription_history(self):
+        app, token = self.seeded_app()
+        return Request('get', '/app/{}/history/'.format(app.pk), token=token)
+
+    def revenue_report(self):
+        return Request('get', '/reports/revenue/', token=self.staff_token)
+
+    def metrics(self):
+        return Request('get', '/metrics')
+
+    def scenarios(self):
+        return {name: getattr(self, name) for name in QUERY_BUDGETS}
+
+    # Running
+
+    def send(self, request):
+        if request.token:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + request.token)
+        else:
+            self.client.credentials()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, request.method)(
+                request.path, request.data, format='json', **request.headers
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(queries)
+
+    def run_scenario(self, prepare):
+        latencies, query_counts, status_codes = [], [], {}
+        for _ in range(self.requests):
+            request = prepare()
+            event_buffer.flush()
+            status_code, elapsed, query_count = self.send(request)
+            latencies.append(elapsed)
+            query_counts.append(query_count)
+            status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+        latencies.sort()
+        total = sum(latencies)
+        return {
+            'route': resolve(request.path.split('?')[0]).route,
+            'requests': len(latencies),
+            'throughput_rps': round(len(latencies) / total, 1) if total else None,
+            'latency_ms': {
+                'mean': round(total / len(latencies) * 1000, 3),
+                'p50': round(percentile(latencies, 50) * 1000, 3),
+                'p95': round(percentile(latencies, 95) * 1000, 3),
+                'p99': round(percentile(latencies, 99) * 1000, 3),
+            },
+            'queries': {
+                'max': max(query_counts),
+                'mean': round(sum(query_counts) / len(query_counts), 2),
+            },
+            'status_codes': status_codes,
+        }
+
+    def run(self, only=None):
+        self.seed()
+        # Measure what the endpoints cost, not how quickly the login throttle rejects them.
+        # Logouts and password changes stamp revocations: keep them out of a running server's file.
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            LOGIN_THROTTLE=dict(settings.LOGIN_THROTTLE, ENABLED=False),
+            SHARED_STATE=dict(settings.SHARED_STATE, PATH=os.path.join(directory, 'shared')),
+        ):
+            return self.run_scenarios(only)
+
+    def run_scenarios(self, only=None):
+        return {
+            'config': {
+                'users': self.users,
+                'apps_per_user': self.apps_per_user,
+                'requests': self.requests,
+            },
+            'endpoints': {
+                name: self.run_scenario(prepare)
+                for name, prepare in self.scenarios().items()
+                if not only or name in only
+            },
+        }
+
+
+def check_budgets(results, budgets):
+    """Return a message for every endpoint whose worst request exceeded its query budget."""
+    failures = []
+    for name, result in results['endpoints'].items():
+        budget = budgets.get(name)
+        if budget is not None and result['queries']['max'] > budget:
+            failures.append('{}: {} queries (budget {})'.format(name, result['queries']['max'], budget))
+    return failures
@@ -0,0 +1,71 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .history import make_event, record_events
+from .models import App, Subscription, SubscriptionEvent
+from .plans import plan_catalog
+
+
+def _assign_inserted_pks(user, apps):
+    # Backends without INSERT ... RETURNING support (SQLite on this Django
+    # version) leave the primary keys unset. The transaction holds SQLite's
+    # writer lock from the first insert on, so the newest rows of this user are
+    # exactly the ones just inserted.
+    pks = list(
+        App.objects.filter(user=user).order_by('-pk').values_list('pk', flat=True)[:len(apps)]
+    )
+    for app, pk in zip(apps, reversed(pks)):
+        app.pk = pk
+
+
+def bulk_create_apps(user, items):
+    """
+    Insert apps and their FREE subscriptions in one transaction.
+
+    ``items`` are validated AppSerializer payloads. Returns the created apps,
+    re-read with their subscription and plan.
+    """
+    free_plan = plan_catalog.get('FREE')
+    with transaction.atomic():
+        apps = App.objects.bulk_create([App(user=user, **item) for item in items])
+        if not connection.features.can_return_rows_from_bulk_insert:
+            _assign_inserted_pks(user, apps)
+        Subscription.objects.bulk_create([Subscription(app=app, plan=free_plan) for app in apps])
+        record_events([make_event(app.pk, SubscriptionEvent.CREATED, free_plan.name) for app in apps])
+        return list(
+            App.objects.filter(user=user, pk__in=[app.pk for app in apps])
+            .select_related('subscription__plan')
+            .order_by('pk')
+        )
+
+
+def bulk_change_plan(user, plan, app_ids=None):
+    """
+    Move apps of ``user`` to ``plan`` with one set-based UPDATE.
+
+    ``app_ids=None`` selects all apps of the user. Apps without a subscription
+    get one through a single bulk insert. Returns (updated, created, not_found).
+    """
+    apps = App.objects.filter(user=user)
+    not_found = []
+    with transaction.atomic():
+        if app_ids is None:
+            selected = apps.values('pk')
+        else:
+            selected = set(apps.filter(pk__in=app_ids).values_list('pk', flat=True))
+            not_found = sorted(set(app_ids) - selected)
+        subscriptions = Subscription.objects.filter(app_id__in=selected)
+        # Previous state, for the history of the rows the UPDATE is about to change.
+        previous = subscriptions.values_list('app_id', 'plan__name', 'active')
+        events = [
+            make_event(app_id, SubscriptionEvent.PLAN_CHANGED, plan.name, previous_plan)
+            if previous_plan != plan.name else make_event(app_id, SubscriptionEvent.REACTIVATED, plan.name)
+            for app_id, previous_plan, active in previous
+            if previous_plan != plan.name or not active
+        ]
+        updated = subscriptions.update(plan=plan, active=True, updated_at=timezone.now())
+        missing = apps.filter(pk__in=selected, subscription__isnull=True).values_list('pk', flat=True)
+        created = Subscription.objects.bulk_create([Subscription(app_id=pk, plan=plan) for pk in missing])
+        events += [make_event(subscription.app_id, SubscriptionEvent.CREATED, plan.name) for subscription in created]
+        record_events(events)
+    return updated, len(created), not_found
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .metrics import RESPONSE_CACHE_LOOKUPS
+
+
+class ResponseCache:
+    """
+    Per-user cache of serialized app responses.
+
+    Keys combine the user, a per-user version counter that every write path
+    bumps, the request URL and the representation's ETag. The ETag is derived
+    from the rows themselves (see api.conditional), so even a process-local
+    backend that missed another worker's version bump can never serve data
+    older than the database. The version counter retires all of a user's
+    entries at once on a write.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local_backend = None
+
+    @property
+    def options(self):
+        return settings.APP_RESPONSE_CACHE
+
+    @property
+    def backend(self):
+        alias = self.options.get('ALIAS')
+        if alias:
+            return caches[alias]
+        if self._local_backend is None:
+            self._local_backend = LocMemCache('api-responses', {
+                'TIMEOUT': self.options.get('TIMEOUT', 300),
+                'OPTIONS': {'MAX_ENTRIES': self.options.get('MAX_ENTRIES', 10000)},
+            })
+        return self._local_backend
+
+    @property
+    def enabled(self):
+        return self.options.get('ENABLED', True)
+
+    def version_key(self, user):
+        return 'api:responses:version:{}'.format(user.pk)
+
+    def get_version(self, user):
+        return self.backend.get(self.version_key(user), 0)
+
+    def bump(self, user):
+        if not self.enabled:
+            return
+        key = self.version_key(user)
+        try:
+            self.backend.incr(key)
+        except ValueError:
+            # No version stored yet (or it was evicted): any new value retires old entries.
+            if not self.backend.add(key, 1, timeout=None):
+                self.backend.incr(key)
+
+    def make_key(self, request, etag):
+        url = request.build_absolute_uri()
+        digest = hashlib.md5('{}|{}'.format(url, etag).encode()).hexdigest()
+        return 'api:responses:{}:{}:{}'.format(request.user.pk, self.get_version(request.user), digest)
+
+    def get(self, key):
+        data = self.backend.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        # stats() covers this process; the counter is aggregated across workers at /metrics.
+        RESPONSE_CACHE_LOOKUPS.labels('miss' if data is None else 'hit').inc()
+        return data
+
+    def set(self, key, data):
+        self.backend.set(key, data, timeout=self.options.get('TIMEOUT', 300))
+
+    def get_or_build(self, request, etag, build):
+        """Return (data, hit). ``build`` is called on a miss and its result is stored."""
+        if not self.enabled or etag is None:
+            return build(), False
+        key = self.make_key(request, etag)
+        data = self.get(key)
+        if data is not None:
+            return data, True
+        data = build()
+        self.set(key, data)
+        return data, False
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        # Never flush a shared Django cache; only the private local one.
+        if self._local_backend is not None:
+            self._local_backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,54 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .models import App
+
+
+def make_etag(*parts):
+    """
+    Build a weak ETag from the state a representation depends on.
+
+    No Last-Modified is derived from the timestamps among ``parts``: it has
+    one-second resolution, so an edit in the same second as the client's last
+    GET would still match If-Modified-Since, and a deletion does not move the
+    newest timestamp at all. The ETag sees both.
+    """
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return 'W/' + quote_etag(digest)
+
+
+def app_list_etag(user):
+    # One aggregate over the user's apps. The app count catches deletions.
+    # App.updated_at catches edits and Subscription.updated_at catches plan changes.
+    state = App.objects.filter(user=user).aggregate(
+        count=Count('id'),
+        app_updated=Max('updated_at'),
+        subscription_updated=Max('subscription__updated_at'),
+    )
+    return make_etag(user.pk, state['count'], state['app_updated'], state['subscription_updated'])
+
+
+def app_detail_etag(user, pk):
+    state = App.objects.filter(user=user, pk=pk).values_list('updated_at', 'subscription__updated_at').first()
+    if state is None:
+        return None
+    return make_etag(user.pk, pk, *state)
+
+
+def set_etag(response, etag):
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+def not_modified(request, etag):
+    """Return a 304 response when the request's If-None-Match matches, otherwise None."""
+    if etag is None:
+        return None
+    headers = set_etag(HttpResponse(), etag)
+    response = get_conditional_response(request, etag=etag, response=headers)
+    return None if response is headers else response
@@ -0,0 +1,131 @@
+"""
+Deferred, chunked deletion of apps and accounts.
+
+Model.delete() runs Django's collector, which loads every related row into
+memory and deletes them all in one transaction, so deleting a user with many
+apps holds SQLite's writer lock for the whole cascade. Instead an app is
+marked deleted (App.deleted_at, hidden by App.objects) and an account is
+deactivated with an AccountDeletion row, both at once. purge_deleted() then
+removes the rows with set-based DELETEs, ``chunk_size`` apps per short
+transaction, so the writer lock is never held for more than one chunk.
+
+Run it with ``manage.py purge_deleted``.
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .history import make_event, record_events
+from .models import AccountDeletion, App, IdempotencyKey, Subscription, SubscriptionEvent
+
+
+def prefers_async(request):
+    """Whether the request sent ``Prefer: respond-async`` (RFC 7240)."""
+    preferences = request.headers.get('Prefer', '')
+    return any(
+        preference.split(';')[0].split('=')[0].strip().lower() == 'respond-async'
+        for preference in preferences.split(',')
+    )
+
+
+def mark_app_deleted(app, now=None):
+    """Hide ``app`` and deactivate its subscription; select_related('subscription__plan') saves the lookups."""
+    now = now or timezone.now()
+    try:
+        subscription = app.subscription
+    except Subscription.DoesNotExist:
+        subscription = None
+    with transaction.atomic():
+        App.all_objects.filter(pk=app.pk).update(deleted_at=now, updated_at=now)
+        if subscription is not None and Subscription.objects.filter(pk=subscription.pk, active=True).update(
+            active=False, updated_at=now,
+        ):
+            record_events([make_event(app.pk, SubscriptionEvent.DEACTIVATED, subscription.plan.name)])
+
+
+def mark_account_deleted(user):
+    """Deactivate ``user`` and revoke its tokens now; the data is purged later."""
+    with transaction.atomic():
+        deletion, _ = AccountDeletion.objects.get_or_create(user=user)
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        token_cache.evict_user(user)
+        Token.objects.filter(user=user).delete()
+    return deletion
+
+
+def raw_delete(queryset):
+    # One DELETE ... WHERE, without the collector loading rows or following relations.
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_apps(pks, with_history=False):
+    if with_history:
+        raw_delete(SubscriptionEvent.objects.filter(app_id__in=pks))
+    raw_delete(Subscription.objects.filter(app_id__in=pks))
+    return raw_delete(App.all_objects.filter(pk__in=pks))
+
+
+def purge_app_chunk(chunk_size):
+    """
+    Delete up to ``chunk_size`` apps marked deleted, with their subscriptions,
+    in one transaction. Their history is kept, as for a direct delete.
+    """
+    with transaction.atomic():
+        pks = list(App.all_objects.filter(deleted_at__isnull=False).values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return 0
+        return delete_apps(pks)
+
+
+def purge_account_chunk(deletion, chunk_size):
+    """
+    Delete the next chunk of the account's data in one transaction: up to
+    ``chunk_size`` apps with their subscriptions and history, then its
+    idempotency keys, and once nothing large is left the user row itself.
+    Returns the number of rows deleted, 0 once the account is gone.
+    """
+    with transaction.atomic():
+        pks = list(App.all_objects.filter(user_id=deletion.user_id).values_list('pk', flat=True)[:chunk_size])
+        if pks:
+            return delete_apps(pks, with_history=True)
+        keys = IdempotencyKey.objects.filter(user_id=deletion.user_id)
+        pks = list(keys.values_list('pk', flat=True)[:chunk_size])
+        if pks:
+            return raw_delete(IdempotencyKey.objects.filter(pk__in=pks))
+        # Only the token and permission rows are left for the collector.
+        User.objects.filter(pk=deletion.user_id).delete()
+        AccountDeletion.objects.filter(pk=deletion.pk).update(completed_at=timezone.now())
+        return 0
+
+
+def run_chunks(purge_chunk, chunk_size, pause, on_chunk):
+    total = 0
+    while True:
+        started = time.monotonic()
+        count = purge_chunk(chunk_size)
+        total += count
+        if on_chunk is not None:
+            on_chunk(count, time.monotonic() - started)
+        if count == 0:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def purge_deleted(chunk_size=1000, pause=0, on_chunk=None):
+    """
+    Purge every app marked deleted, then every account marked deleted.
+    ``pause`` seconds between chunks let other writers take the lock, and
+    ``on_chunk(count, seconds)`` is called after each transaction. Returns
+    (rows deleted for apps, rows deleted for accounts, accounts completed).
+    """
+    apps = run_chunks(purge_app_chunk, chunk_size, pause, on_chunk)
+    accounts = rows = 0
+    for deletion in AccountDeletion.objects.filter(completed_at__isnull=True).order_by('requested_at'):
+        rows += run_chunks(lambda size: purge_account_chunk(deletion, size), chunk_size, pause, on_chunk)
+        accounts += 1
+    return apps, rows, accounts
@@ -0,0 +1,59 @@
+import time
+
+from django.db import transaction
+
+from .history import make_event
+from .models import Subscription, SubscriptionEvent
+
+
+def expired_subscriptions(now):
+    # Matches the condition of the partial api_sub_expiry_idx index, so only
+    # active subscriptions with an end date are ever looked at.
+    return Subscription.objects.filter(active=True, end_date__isnull=False, end_date__lte=now)
+
+
+def expire_chunk(now, chunk_size):
+    """
+    Deactivate up to ``chunk_size`` subscriptions that ended by ``now`` in one
+    short transaction, and return how many were deactivated.
+
+    The chunk is one indexed SELECT of ids, one UPDATE by primary key and one
+    bulk insert of their history events. The sweeper is not on a request
+    path, so events are written directly rather than through the buffer.
+    updated_at is bumped so the ETags of the affected apps, and with them any
+    cached responses, change (see api.conditional).
+    """
+    with transaction.atomic():
+        expired = list(
+            expired_subscriptions(now).order_by('end_date')
+            .values_list('pk', 'app_id', 'plan__name')[:chunk_size]
+        )
+        if not expired:
+            return 0
+        count = Subscription.objects.filter(pk__in=[pk for pk, _, _ in expired], active=True).update(
+            active=False, updated_at=now,
+        )
+        SubscriptionEvent.objects.bulk_create([
+            make_event(app_id, SubscriptionEvent.DEACTIVATED, plan) for _, app_id, plan in expired
+        ])
+        return count
+
+
+def expire_subscriptions(now, chunk_size=1000, pause=0, on_chunk=None):
+    """
+    Deactivate every subscription that ended by ``now``, one chunk at a time.
+
+    Each chunk commits on its own, so an interrupted sweep loses nothing and
+    the next run continues with whatever is still active. ``pause`` seconds
+    between chunks let other writers take the lock. Returns the total count.
+    """
+    total = 0
+    while True:
+        count = expire_chunk(now, chunk_size)
+        total += count
+        if on_chunk is not None:
+            on_chunk(count, total)
+        if count < chunk_size:
+            return total
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,122 @@
+"""
+Streaming export of a user's apps with their subscriptions (GET /app/export/).
+
+Rows are read in keyset-ordered chunks of APP_EXPORT_CHUNK_SIZE, one indexed
+range query per chunk, and encoded chunk by chunk, so memory use does not
+depend on how many apps the user has.
+"""
+import csv
+import io
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+from .models import App
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import app_row_position, app_rows, serialize_app_rows
+
+CSV_COLUMNS = [
+    'id', 'name', 'description', 'created_at', 'updated_at',
+    'subscription_id', 'plan', 'price', 'active', 'start_date', 'end_date',
+]
+
+
+def app_chunks(user, chunk_size=None):
+    """Yield the user's apps as lists of serialized rows, in (created_at, id) order."""
+    chunk_size = chunk_size or settings.APP_EXPORT_CHUNK_SIZE
+    queryset = app_rows(App.objects.filter(user=user)).order_by('created_at', 'id')
+    position = None
+    while True:
+        page = queryset if position is None else KeysetPagination.filter_after(queryset, *position)
+        rows = list(page[:chunk_size])
+        if rows:
+            yield serialize_app_rows(rows)
+        if len(rows) < chunk_size:
+            return
+        position = app_row_position(rows[-1])
+
+
+def encode_ndjson(chunks):
+    renderer = FastJSONRenderer()
+    for chunk in chunks:
+        yield b''.join(renderer.render(item) + b'\n' for item in chunk)
+
+
+def encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for chunk in chunks:
+        for item in chunk:
+            subscription = item['subscription'] or {}
+            plan = subscription.get('plan') or {}
+            writer.writerow([
+                item['id'], item['name'], item['description'], item['created_at'], item['updated_at'],
+                subscription.get('id'), plan.get('name'), plan.get('price'), subscription.get('active'),
+                subscription.get('start_date'), subscription.get('end_date'),
+            ])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+ENCODERS = {
+    'ndjson': ('application/x-ndjson', encode_ndjson),
+    'csv': ('text/csv; charset=utf-8', encode_csv),
+}
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch_in_thread(iterable, size=None):
+    """
+    Iterate ``iterable`` in a worker thread, keeping up to ``size`` items ready.
+
+    The ASGI handler of this Django version iterates streaming responses
+    synchronously on the event loop, where the ORM refuses to run. The
+    worker thread does the queries (on its own connection, closed when it
+    finishes) and the event loop only takes encoded chunks off the queue.
+    """
+    size = size or settings.APP_EXPORT_PREFETCH_CHUNKS
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up once the consumer has gone away, e.g. on a client disconnect.
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(_Failure(e))
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=produce, name='app-export', daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
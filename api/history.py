@@ -0,0 +1,114 @@
+"""
+Write-behind buffer for SubscriptionEvent rows.
+
+Views queue events once their transaction commits; the buffer writes them
+with one bulk insert when it holds SUBSCRIPTION_EVENTS['BUFFER_SIZE'] events,
+and a background thread flushes whatever is pending every FLUSH_INTERVAL
+seconds. start_event_flusher() is called by backend_app.wsgi and
+backend_app.asgi; it also flushes at interpreter exit (gunicorn's
+worker_exit hook flushes explicitly). A process forked from one with a
+running flusher (gunicorn's preload_app) starts its own with an empty
+buffer. Other processes call event_buffer.flush() themselves.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+from .models import SubscriptionEvent
+
+logger = logging.getLogger('api.history')
+
+
+def make_event(app_id, kind, plan, previous_plan=None):
+    return SubscriptionEvent(app_id=app_id, kind=kind, plan=plan, previous_plan=previous_plan)
+
+
+class EventBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def options(self):
+        return settings.SUBSCRIPTION_EVENTS
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
+
+    def add(self, events):
+        with self._lock:
+            self._events.extend(events)
+            full = len(self._events) >= self.options['BUFFER_SIZE']
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write all pending events. Returns how many were written."""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            SubscriptionEvent.objects.bulk_create(events, batch_size=self.options['BUFFER_SIZE'])
+        except DatabaseError:
+            logger.exception('Could not write %d subscription events, will retry', len(events))
+            with self._lock:
+                self._events[:0] = events
+            return 0
+        return len(events)
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+
+    def start(self):
+        interval = self.options.get('FLUSH_INTERVAL')
+        if not interval or (self._thread is not None and self._thread.is_alive()):
+            return
+        if self._thread is None:
+            atexit.register(self.stop)
+            os.register_at_fork(after_in_child=self._after_fork)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='subscription-events', daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def _after_fork(self):
+        # The flusher thread does not survive fork and its locks may have been
+        # held at the time; the parent's pending events are the parent's to write.
+        running = not self._stop.is_set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._events = []
+        if running:
+            self.start()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+            close_old_connections()
+
+
+event_buffer = EventBuffer()
+
+
+def record_events(events):
+    """Queue ``events`` for writing once the current transaction commits."""
+    if events:
+        transaction.on_commit(lambda: event_buffer.add(events))
+
+
+def start_event_flusher():
+    event_buffer.start()
@@ -0,0 +1,159 @@
+"""
+Idempotency-Key support for write endpoints.
+
+The first request with a key claims it by inserting an IdempotencyKey row,
+which commits straight away so other workers see the claim. The view then
+runs in a transaction that also stores its response on the row, so a write
+is never committed without the response a retry will get. Retries with the
+same key and request get the stored response (``Idempotent-Replayed: true``)
+without running the view. A retry that arrives while the first request is
+still running polls the row for up to IDEMPOTENCY['WAIT_TIMEOUT'] seconds
+and gets 409 if it is still not done.
+
+Responses are kept for IDEMPOTENCY['TTL'] seconds. A claim whose request
+never finished (the worker died) can be taken over after LOCK_TIMEOUT
+seconds. Server errors are not stored: the claim is released so the client
+can retry. Expired rows are deleted by ``manage.py purge_idempotency_keys``.
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .renderers import FastJSONRenderer
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.25
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(user, key, fingerprint, now):
+    """Insert the claim for ``key``. Returns None if it was claimed, otherwise the existing row."""
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY['LOCK_TIMEOUT'])
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint, created_at=now, expires_at=expires_at,
+            )
+        return None
+    except IntegrityError:
+        pass
+    existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if existing is not None and existing.expires_at <= now:
+        # Finished long ago, or abandoned by a request that never completed.
+        IdempotencyKey.objects.filter(pk=existing.pk, expires_at=existing.expires_at).delete()
+        return claim(user, key, fingerprint, now)
+    return existing
+
+
+def replay(record):
+    response = Response(json.loads(record.response) if record.response else None, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def error(message, code, retry_after=None):
+    response = Response({'error': message}, status=code)
+    if retry_after is not None:
+        response['Retry-After'] = str(retry_after)
+    return response
+
+
+def wait_for(user, key, fingerprint, record):
+    """Wait for the request holding ``key`` to finish and replay its response."""
+    deadline = time.monotonic() + settings.IDEMPOTENCY['WAIT_TIMEOUT']
+    delay = POLL_INTERVAL
+    while True:
+        if record is None:
+            # The first request failed and released the key, or it expired.
+            return None
+        if record.fingerprint != fingerprint:
+            return error(
+                '{} was already used with a different request'.format(HEADER),
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.status_code is not None:
+            return replay(record)
+        if time.monotonic() >= deadline:
+            return error(
+                'A request with this {} is still in progress'.format(HEADER),
+                status.HTTP_409_CONFLICT, retry_after=1,
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def idempotent(handler):
+    """
+    Make an APIView handler honour the Idempotency-Key header. Requests
+    without the header run the handler as before.
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return error(
+                '{} must be 1 to {} characters'.format(HEADER, MAX_KEY_LENGTH), status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        while True:
+            claimed_at = timezone.now()
+            record = claim(request.user, key, fingerprint, claimed_at)
+            if record is None:
+                break
+            response = wait_for(request.user, key, fingerprint, record)
+            if response is not None:
+                return response
+
+        # Matched on created_at as well, so a request that outlived its claim
+        # cannot overwrite or release the claim of the request that took over.
+        claimed = IdempotencyKey.objects.filter(user=request.user, key=key, created_at=claimed_at)
+        try:
+            with transaction.atomic():
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code < 500:
+                    claimed.update(
+                        status_code=response.status_code,
+                        response=FastJSONRenderer().render(response.data).decode(),
+                        expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY['TTL']),
+                    )
+        except Exception:
+            claimed.delete()
+            raise
+        if response.status_code >= 500:
+            claimed.delete()
+        return response
+
+    return wrapper
+
+
+def purge_expired(now=None, chunk_size=1000):
+    """Delete expired keys, ``chunk_size`` rows per statement. Returns the count."""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        pks = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return total
+        total += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
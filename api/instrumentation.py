@@ -0,0 +1,103 @@
+"""
+Per-request timing collected by api.middleware.RequestInstrumentationMiddleware.
+
+The middleware puts a RequestMetrics in ``current_metrics`` for the duration
+of a request. Context variables follow the request into sync_to_async
+threads, so queries and serialization are attributed to the right request
+under ASGI as well. With no metrics set, every hook here is a single
+context variable lookup.
+"""
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, slow_queries=5):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        # Aliases of the databases queried, to report replica lag.
+        self.databases = set()
+        self.slow_queries = slow_queries
+        # Min-heap of (duration, sequence, sql): the root is the fastest of the slowest.
+        self._slowest = []
+        self._sequence = itertools.count()
+
+    def add_query(self, sql, duration, alias='default'):
+        self.queries += 1
+        self.databases.add(alias)
+        self.sql_time += duration
+        if not self.slow_queries:
+            return
+        item = (duration, next(self._sequence), sql)
+        if len(self._slowest) < self.slow_queries:
+            heapq.heappush(self._slowest, item)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def slowest_queries(self):
+        return [
+            {'sql': sql, 'ms': round(duration * 1000, 3)}
+            for duration, _, sql in sorted(self._slowest, reverse=True)
+        ]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started, context['connection'].alias)
+
+
+def install_query_recorder(connection, **kwargs):
+    # Receiver for connection_created; also called directly for existing connections.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializer_timer():
+    """Add the time spent in the block to the current request's serializer time."""
+    metrics = current_metrics.get()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - started
+        metrics.serializing = False
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; ``extra`` dicts passed as ``fields`` are merged in."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
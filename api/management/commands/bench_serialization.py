@@ -0,0 +1,70 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from api.bulk import bulk_create_apps
+from api.models import App
+from api.renderers import FastJSONRenderer
+from api.serializers import AppSerializer, app_rows, serialize_app_rows
+
+SEED_BATCH_SIZE = 500
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare AppSerializer + JSONRenderer with the values() projection + FastJSONRenderer '
+        'for app listings, on apps seeded into a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000],
+                            help='Numbers of apps to serialize.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the best is reported.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>8}  {:>14}  {:>14}  {:>8}'.format('apps', 'serializer ms', 'fast path ms', 'speedup'))
+        # Never seed the configured database: a long seeding transaction would
+        # hold SQLite's writer lock against a running server.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed_and_measure(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed_and_measure(self, options):
+        user = User.objects.create(username='bench')
+        created = 0
+        for size in sorted(options['sizes']):
+            while created < size:
+                count = min(SEED_BATCH_SIZE, size - created)
+                bulk_create_apps(user, [
+                    {'name': 'App {}'.format(created + i), 'description': 'Benchmark app'} for i in range(count)
+                ])
+                created += count
+            self.measure(App.objects.filter(user=user), size, options['repeat'])
+
+    def measure(self, apps, size, repeat):
+        baseline, expected = best_of(repeat, lambda: JSONRenderer().render(
+            AppSerializer(apps.select_related('subscription__plan'), many=True).data
+        ))
+        fast, actual = best_of(repeat, lambda: FastJSONRenderer().render(serialize_app_rows(app_rows(apps))))
+        if actual != expected:
+            self.stderr.write('Output differs at {} apps'.format(size))
+        self.stdout.write('{:>8}  {:>14.2f}  {:>14.2f}  {:>7.1f}x'.format(
+            size, baseline * 1000, fast * 1000, baseline / fast if fast else 0,
+        ))
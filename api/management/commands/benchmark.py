@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.benchmark import QUERY_BUDGETS, EndpointBenchmark, check_budgets
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database and drive every API route through an in-process client, '
+        'reporting throughput, p50/p95/p99 latency and SQL queries per endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users to seed.')
+        parser.add_argument('--apps-per-user', type=int, default=100,
+                            help='Apps (each with a FREE subscription) seeded per user.')
+        parser.add_argument('--requests', type=int, default=20, help='Requests sent to each endpoint.')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=sorted(QUERY_BUDGETS),
+                            help='Only benchmark this endpoint. Can be repeated.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--budgets',
+                            help='JSON file mapping endpoint names to query budgets, merged over the defaults.')
+        parser.add_argument('--check', action='store_true',
+                            help='Exit with an error if any endpoint exceeds its query budget.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['apps_per_user'] < 1 or options['requests'] < 1:
+            raise CommandError('--users, --apps-per-user and --requests must be positive')
+        budgets = dict(QUERY_BUDGETS)
+        if options['budgets']:
+            try:
+                with open(options['budgets']) as f:
+                    budgets.update(json.load(f))
+            except (OSError, ValueError) as e:
+                raise CommandError('Could not read budgets: {}'.format(e))
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            benchmark = EndpointBenchmark(options['users'], options['apps_per_user'], options['requests'])
+            results = benchmark.run(only=options['endpoints'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results, budgets)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        failures = check_budgets(results, budgets)
+        if failures and options['check']:
+            raise CommandError('Query budget exceeded: ' + '; '.join(failures))
+
+    def report(self, results, budgets):
+        self.stdout.write('{:<26} {:>8} {:>9} {:>9} {:>9} {:>8} {:>7}'.format(
+            'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'budget'))
+        for name, result in results['endpoints'].items():
+            latency = result['latency_ms']
+            budget = budgets.get(name)
+            self.stdout.write('{:<26} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>8} {:>7}'.format(
+                name, result['throughput_rps'], latency['p50'], latency['p95'], latency['p99'],
+                result['queries']['max'], '-' if budget is None else budget,
+            ))
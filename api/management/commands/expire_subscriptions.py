@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from api.expiry import expire_subscriptions
+
+
+class Command(BaseCommand):
+    help = 'Deactivate active subscriptions whose end_date has passed, in chunks of short UPDATEs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Subscriptions deactivated per UPDATE and transaction.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between chunks so other writers get the lock.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, sweeping every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between sweeps with --loop.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        if options['sleep'] < 0 or options['interval'] < 0:
+            raise CommandError('--sleep and --interval must not be negative')
+        self.verbosity = options['verbosity']
+
+        if not options['loop']:
+            self.sweep(options)
+            return
+        try:
+            while True:
+                self.sweep(options)
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+    def sweep(self, options):
+        started = time.monotonic()
+        total = expire_subscriptions(
+            timezone.now(), options['chunk_size'], options['sleep'], on_chunk=self.report_chunk,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write('Deactivated {} expired subscriptions in {:.1f}s ({:.0f}/s)'.format(
+            total, elapsed, total / elapsed if elapsed else 0,
+        ))
+
+    def report_chunk(self, count, total):
+        if self.verbosity >= 2:
+            self.stdout.write('  chunk of {}, {} so far'.format(count, total))
@@ -0,0 +1,114 @@
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+
+
+def read_ndjson(f):
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def read_csv(f):
+    # Line 1 is the header.
+    for line_number, row in enumerate(csv.DictReader(f), 2):
+        yield line_number, row
+
+
+class Command(BaseCommand):
+    help = 'Import users from an NDJSON or CSV file with username, password and email fields.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Input format. Defaults to csv for .csv files and ndjson otherwise.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users hashed and inserted per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used for password hashing. 1 hashes in this process.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        batch_size = options['batch_size']
+        if batch_size < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        self.workers = options['workers']
+        self.imported = self.existing = self.invalid = 0
+        started = time.monotonic()
+        pool = None
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup)
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                rows = read_csv(f) if fmt == 'csv' else read_ndjson(f)
+                while True:
+                    batch = list(itertools.islice(rows, batch_size))
+                    if not batch:
+                        break
+                    self.import_batch(batch, pool)
+        except OSError as e:
+            raise CommandError(e)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            'Imported {} users in {:.1f}s ({:.0f}/s), skipped {} existing and {} invalid rows'.format(
+                self.imported, elapsed, self.imported / elapsed if elapsed else 0, self.existing, self.invalid,
+            )
+        )
+
+    def import_batch(self, batch, pool):
+        rows = {}
+        for line_number, row in batch:
+            username = str((row or {}).get('username') or '')
+            password = str((row or {}).get('password') or '')
+            if not username or not password or len(username) > USERNAME_MAX_LENGTH:
+                self.stderr.write('Line {}: a username of at most {} characters and a password are required'.format(
+                    line_number, USERNAME_MAX_LENGTH))
+                self.invalid += 1
+                continue
+            if username in rows:
+                self.existing += 1
+                continue
+            rows[username] = dict(row, username=username, password=password)
+
+        existing = set(User.objects.filter(username__in=list(rows)).values_list('username', flat=True))
+        self.existing += len(existing)
+        rows = [row for username, row in rows.items() if username not in existing]
+        if not rows:
+            return
+
+        passwords = [row['password'] for row in rows]
+        if pool is None:
+            hashes = [make_password(password) for password in passwords]
+        else:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            hashes = list(pool.map(make_password, passwords, chunksize=chunksize))
+
+        users = [
+            User(username=row['username'], email=row.get('email') or '', password=password)
+            for row, password in zip(rows, hashes)
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+        self.imported += len(users)
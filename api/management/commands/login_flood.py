@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import percentile
+
+
+def request(url, data=None, token=None):
+    """Send one request and return its status code."""
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = 'Token ' + token
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers=headers, method='POST' if body else 'GET')
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test against a running server: measure GET /app/ latency on its own and while other '
+        'clients flood /login with wrong passwords.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running server.')
+        parser.add_argument('--username', required=True, help='Existing user whose apps are listed.')
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per phase.')
+        parser.add_argument('--flood-threads', type=int, default=16, help='Concurrent clients sending logins.')
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        login = json.loads(self.login(base, options['username'], options['password']))
+        token = login['token']
+
+        baseline = self.measure(base, token, options['duration'])
+        stop = threading.Event()
+        flood_statuses = {}
+        lock = threading.Lock()
+
+        def flood():
+            victim = options['username']
+            while not stop.is_set():
+                # Alternate between the real user and random names, like credential stuffing.
+                username = victim if uuid.uuid4().int % 2 else 'user-' + uuid.uuid4().hex[:8]
+                code = request(base + '/login', {'username': username, 'password': 'wrong-password'})
+                with lock:
+                    flood_statuses[code] = flood_statuses.get(code, 0) + 1
+
+        threads = [threading.Thread(target=flood, daemon=True) for _ in range(options['flood_threads'])]
+        for thread in threads:
+            thread.start()
+        try:
+            flooded = self.measure(base, token, options['duration'])
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write('{:<10} {:>8} {:>9} {:>9} {:>9}'.format('GET /app/', 'requests', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name, latencies in [('baseline', baseline), ('flood', flooded)]:
+            self.stdout.write('{:<10} {:>8} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                name, len(latencies), percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000,
+            ))
+        self.stdout.write('Login flood responses: {}'.format(
+            ', '.join('{} x {}'.format(count, code) for code, count in sorted(flood_statuses.items()))
+        ))
+
+    def login(self, base, username, password):
+        req = urllib.request.Request(
+            base + '/login', data=json.dumps({'username': username, 'password': password}).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.read()
+        except (urllib.error.URLError, OSError) as e:
+            raise CommandError('Could not log in as {}: {}'.format(username, e))
+
+    def measure(self, base, token, duration):
+        latencies = []
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            code = request(base + '/app/', token=token)
+            latencies.append(time.perf_counter() - started)
+            if code != 200:
+                raise CommandError('GET /app/ returned {}'.format(code))
+        latencies.sort()
+        return latencies
@@ -0,0 +1,106 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter. "boot" times what a worker without preload_app
+# does: import backend_app.wsgi (django.setup() plus api.warmup). "fork" loads
+# the application like a preloading gunicorn master and times a forked child
+# instead. Either way the worker then serves one request, and reports its
+# resident and private (unshared) memory.
+PROBE = r'''
+import gc, io, json, os, sys, time
+
+def memory():
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                values['rss'] = int(line.split()[1]) * 1024
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    values['private'] = values.get('private', 0) + int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return values
+
+def first_request(application):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/app/', 'QUERY_STRING': '', 'SERVER_NAME': '127.0.0.1',
+        'SERVER_PORT': '8000', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+        'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    started = time.perf_counter()
+    response = application(environ, lambda status, headers: None)
+    b''.join(response)
+    response.close()
+    return time.perf_counter() - started
+
+def report(boot, application):
+    result = dict(boot=boot, first_request=first_request(application), **memory())
+    return json.dumps(result).encode()
+
+started = time.perf_counter()
+from backend_app.wsgi import application
+if sys.argv[1] == 'boot':
+    sys.stdout.buffer.write(report(time.perf_counter() - started, application))
+else:
+    gc.freeze()
+    read, write = os.pipe()
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, report(time.perf_counter() - forked, application))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        sys.stdout.buffer.write(f.read())
+    os.waitpid(pid, 0)
+'''
+
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure per-worker startup time and memory for each settings module, with and without '
+        'gunicorn preload_app. Each run starts a fresh interpreter against the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=['backend_app.settings', 'backend_app.settings_api'],
+                            help='Settings modules to compare.')
+        parser.add_argument('--runs', type=int, default=5, help='Runs per combination; medians are reported.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:<26} {:<8} {:>9} {:>14} {:>8} {:>11}'.format(
+            'settings', 'preload', 'start ms', '1st request ms', 'RSS MB', 'private MB',
+        ))
+        for profile in options['profiles']:
+            for mode in ['boot', 'fork']:
+                runs = [self.probe(profile, mode) for _ in range(options['runs'])]
+                private = [run['private'] for run in runs if 'private' in run]
+                self.stdout.write('{:<26} {:<8} {:>9.1f} {:>14.1f} {:>8.1f} {:>11}'.format(
+                    profile, 'yes' if mode == 'fork' else 'no',
+                    statistics.median(run['boot'] for run in runs) * 1000,
+                    statistics.median(run['first_request'] for run in runs) * 1000,
+                    statistics.median(run['rss'] for run in runs) / MB,
+                    '{:.1f}'.format(statistics.median(private) / MB) if private else '-',
+                ))
+
+    def probe(self, profile, mode):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+        process = subprocess.run(
+            [sys.executable, '-c', PROBE, mode], cwd=settings.BASE_DIR, env=env, capture_output=True,
+        )
+        if process.returncode:
+            raise CommandError('{} ({}) failed:\n{}'.format(profile, mode, process.stderr.decode()))
+        return json.loads(process.stdout)
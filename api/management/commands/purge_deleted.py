@@ -0,0 +1,66 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.deletion import mark_account_deleted, purge_deleted
+
+
+class Command(BaseCommand):
+    help = (
+        'Purge apps and accounts marked deleted, in chunks of set-based DELETEs each in its own short '
+        'transaction. --account marks accounts deleted first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', action='append', default=[], metavar='USERNAME',
+                            help='Deactivate this account and delete all its data. Repeatable.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Apps deleted per transaction.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between chunks so other writers get the lock.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, purging every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between purges with --loop.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        if options['sleep'] < 0 or options['interval'] < 0:
+            raise CommandError('--sleep and --interval must not be negative')
+        self.verbosity = options['verbosity']
+
+        for username in options['account']:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError('No user named {!r}'.format(username))
+            mark_account_deleted(user)
+            self.stdout.write('Marked account {} deleted'.format(username))
+
+        if not options['loop']:
+            self.purge(options)
+            return
+        try:
+            while True:
+                self.purge(options)
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+    def purge(self, options):
+        self.chunks = []
+        started = time.monotonic()
+        apps, rows, accounts = purge_deleted(options['chunk_size'], options['sleep'], on_chunk=self.report_chunk)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            'Purged {} deleted apps and {} accounts ({} rows) in {:.1f}s; longest transaction {:.1f}ms'.format(
+                apps, accounts, rows, elapsed, max(self.chunks, default=0) * 1000,
+            )
+        )
+
+    def report_chunk(self, count, seconds):
+        self.chunks.append(seconds)
+        if self.verbosity >= 2:
+            self.stdout.write('  chunk of {} rows in {:.1f}ms'.format(count, seconds * 1000))
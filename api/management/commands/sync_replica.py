@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections
+
+from api.routing import copy_to_replica, write_heartbeat
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the replication heartbeat on the primary, then copy the primary into each SQLite read '
+        'replica. With --heartbeat-only, only the heartbeat is written, for replicas kept in sync by the '
+        'database itself.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', action='append', default=[], metavar='ALIAS',
+                            help='Sync only this replica alias. Repeatable; defaults to all of DATABASE_REPLICAS.')
+        parser.add_argument('--heartbeat-only', action='store_true', help='Do not copy the database.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, syncing every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between syncs with --loop.')
+
+    def handle(self, *args, **options):
+        if options['interval'] < 0:
+            raise CommandError('--interval must not be negative')
+        replicas = options['replica'] or settings.DATABASE_REPLICAS
+        unknown = sorted(set(replicas) - set(settings.DATABASE_REPLICAS))
+        if unknown:
+            raise CommandError('Not in DATABASE_REPLICAS: {}'.format(', '.join(unknown)))
+        if not replicas:
+            raise CommandError('No read replicas configured; set DJANGO_DB_REPLICAS')
+
+        if not options['loop']:
+            self.sync(replicas, options)
+            return
+        try:
+            while True:
+                self.sync(replicas, options)
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+    def sync(self, replicas, options):
+        started = time.monotonic()
+        write_heartbeat()
+        if options['heartbeat_only']:
+            return
+        for alias in replicas:
+            try:
+                copy_to_replica(alias)
+            except DatabaseError as e:
+                raise CommandError('Could not sync {}: {}'.format(alias, e))
+        self.stdout.write('Synced {} in {:.1f}ms'.format(', '.join(replicas), (time.monotonic() - started) * 1000))
@@ -0,0 +1,153 @@
+"""
+Prometheus metrics served at /metrics.
+
+Request metrics are updated by api.middleware.MetricsMiddleware. When
+PROMETHEUS_MULTIPROC_DIR is set (see the Dockerfile), prometheus_client keeps
+every worker's values in memory-mapped files in that directory and a scrape
+of any worker aggregates all of them. Business gauges come from the database
+and are cached for METRICS['BUSINESS_TTL'] seconds, so scrapes do not run
+COUNT queries each time.
+"""
+import hmac
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from .routing import replica_lag
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+registry = CollectorRegistry()
+
+REQUESTS = Counter(
+    'api_requests', 'HTTP requests handled, by view, method and status code.',
+    ['view', 'method', 'status'], registry=registry,
+)
+ERRORS = Counter(
+    'api_request_errors', 'Requests that ended with a 5xx response, by view and method.',
+    ['view', 'method'], registry=registry,
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    'api_response_cache_lookups', 'Lookups in the app response cache (api.cache), by result (hit or miss).',
+    ['result'], registry=registry,
+)
+LATENCY = Histogram(
+    'api_request_duration_seconds', 'Request latency, by view and method.',
+    ['view', 'method'], buckets=LATENCY_BUCKETS, registry=registry,
+)
+
+
+def multiprocess_mode():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def observe_request(view, method, status, duration):
+    REQUESTS.labels(view, method, str(status)).inc()
+    if status >= 500:
+        ERRORS.labels(view, method).inc()
+    LATENCY.labels(view, method).observe(duration)
+
+
+class BusinessMetricsCollector:
+    """Gauges computed from the database, refreshed at most once per BUSINESS_TTL seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = None
+        self._expires = 0
+
+    def describe(self):
+        # Registering must not query the database.
+        return []
+
+    def load(self):
+        from .models import App, Plan, Subscription
+
+        active = dict.fromkeys((name for name, _ in Plan.PLAN_CHOICES), 0)
+        # Served from the partial api_sub_active_plan_idx index.
+        active.update(
+            Subscription.objects.filter(active=True)
+            .values_list('plan__name').annotate(count=Count('id')).order_by()
+        )
+        return {'active_subscriptions': active, 'apps': App.objects.count()}
+
+    def get_values(self):
+        with self._lock:
+            if self._values is None or time.monotonic() >= self._expires:
+                try:
+                    self._values = self.load()
+                except DatabaseError:
+                    # Keep serving the last values rather than failing the scrape.
+                    pass
+                self._expires = time.monotonic() + settings.METRICS['BUSINESS_TTL']
+            return self._values
+
+    def clear(self):
+        with self._lock:
+            self._values = None
+            self._expires = 0
+
+    def collect(self):
+        values = self.get_values()
+        if values is None:
+            return
+        active = GaugeMetricFamily('api_active_subscriptions', 'Active subscriptions per plan.', labels=['plan'])
+        for plan, count in sorted(values['active_subscriptions'].items()):
+            active.add_metric([plan], count)
+        yield active
+        yield GaugeMetricFamily('api_apps', 'Apps across all users.', value=values['apps'])
+
+
+business_metrics = BusinessMetricsCollector()
+registry.register(business_metrics)
+
+
+class ReplicaLagCollector:
+    """Lag of each read replica, as cached by api.routing.replica_lag."""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        if not settings.DATABASE_REPLICAS:
+            return
+        lag = GaugeMetricFamily(
+            'api_replica_lag_seconds', 'Age of the newest heartbeat each read replica has.', labels=['replica'],
+        )
+        for alias in settings.DATABASE_REPLICAS:
+            seconds = replica_lag.get(alias)
+            if seconds is not None:
+                lag.add_metric([alias], seconds)
+        yield lag
+
+
+replica_metrics = ReplicaLagCollector()
+registry.register(replica_metrics)
+
+
+def get_registry():
+    if not multiprocess_mode():
+        return registry
+    # Values of every worker, read from PROMETHEUS_MULTIPROC_DIR.
+    aggregated = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregated)
+    aggregated.register(business_metrics)
+    aggregated.register(replica_metrics)
+    return aggregated
+
+
+def metrics_view(request):
+    token = settings.METRICS.get('TOKEN')
+    if token:
+        expected = 'Bearer {}'.format(token).encode()
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+            return HttpResponse(status=401)
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
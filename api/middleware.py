@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .instrumentation import RequestMetrics, current_metrics, install_query_recorder
+from .metrics import observe_request
+from .routing import PRIMARY, choose_replica, read_replica, replica_lag
+from .shared import get_stamps
+
+logger = logging.getLogger('api.requests')
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Record SQL query count, SQL time, serializer time and total time per request.
+
+    The numbers are returned in a Server-Timing header, and requests slower
+    than REQUEST_INSTRUMENTATION['SLOW_REQUEST_MS'] are logged to the
+    ``api.requests`` logger along with their slowest queries. When disabled
+    the middleware removes itself from the chain at startup.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = settings.REQUEST_INSTRUMENTATION
+        if not options.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request_ms = options.get('SLOW_REQUEST_MS')
+        self.slow_queries = options.get('SLOW_QUERIES', 5)
+        self.server_timing = options.get('SERVER_TIMING', True)
+
+        connection_created.connect(install_query_recorder, dispatch_uid='api.instrumentation.record_query')
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Same marker MiddlewareMixin uses to make the handler await this instance.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics(self.slow_queries)
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(self.slow_queries)
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    def finish(self, request, response, metrics):
+        total_ms = metrics.elapsed() * 1000
+        sql_ms = metrics.sql_time * 1000
+        serializer_ms = metrics.serializer_time * 1000
+        if self.server_timing:
+            timings = [
+                'db;dur={:.3f};desc="{} queries"'.format(sql_ms, metrics.queries),
+                'serialize;dur={:.3f}'.format(serializer_ms),
+                'total;dur={:.3f}'.format(total_ms),
+            ]
+            # The lag of each replica read from, so clients can tell how stale the response may be.
+            for alias in sorted(metrics.databases - {PRIMARY}):
+                lag = replica_lag.get(alias)
+                if lag is not None:
+                    timings.append('replica;dur={:.3f};desc="{} lag"'.format(lag * 1000, alias))
+            response['Server-Timing'] = ', '.join(timings)
+        if self.slow_request_ms is not None and total_ms >= self.slow_request_ms:
+            logger.warning('Slow request', extra={'fields': {
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'total_ms': round(total_ms, 3),
+                'sql_ms': round(sql_ms, 3),
+                'queries': metrics.queries,
+                'serializer_ms': round(serializer_ms, 3),
+                'databases': sorted(metrics.databases),
+                'slowest_queries': metrics.slowest_queries(),
+            }})
+
+
+class MetricsMiddleware:
+    """
+    Count requests and 5xx responses and observe latency for the Prometheus
+    metrics in api.metrics, labelled by the name of the view that handled
+    the request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # as_view() and @api_view both carry the view's own name.
+        request.metrics_view_name = getattr(view_func, '__name__', 'unknown')
+
+    def observe(self, request, response, duration):
+        view = getattr(request, 'metrics_view_name', 'unmatched')
+        observe_request(view, request.method, response.status_code, duration)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let safe requests read from one of the read replicas (see api.routing),
+    chosen once per request. Each write stamps the client's write time in a
+    table shared by every process on the host (api.shared), and the client's
+    reads then only use replicas whose heartbeat is at least that recent, so
+    it always reads its own writes. Clients are told apart by their
+    Authorization header. Not used when no replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.reset(token)
+        self.finish(request)
+        return response
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.reset(token)
+        self.finish(request)
+        return response
+
+    def pin_key(self, request):
+        authorization = request.headers.get('Authorization')
+        if not authorization:
+            return None
+        return hashlib.sha256(authorization.encode()).hexdigest()
+
+    def start(self, request):
+        if request.method not in self.safe_methods:
+            return read_replica.set(None)
+        key = self.pin_key(request)
+        wrote_at = get_stamps('replica-pins').get(key) if key is not None else 0.0
+        return read_replica.set(choose_replica(wrote_at))
+
+    def reset(self, token):
+        read_replica.reset(token)
+
+    def finish(self, request):
+        key = self.pin_key(request)
+        if key is not None and request.method not in self.safe_methods:
+            # Stamped after the write committed, and whatever the outcome: a failed request may still have written.
+            get_stamps('replica-pins').touch(key, time.time())
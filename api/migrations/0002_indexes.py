@@ -0,0 +1,25 @@
+# Generated by Django 3.2.10 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='app',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='api_app_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(condition=models.Q(('active', True)), fields=['plan', 'active'], name='api_sub_active_plan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(condition=models.Q(('active', True), ('end_date__isnull', False)), fields=['end_date'], name='api_sub_expiry_idx'),
+        ),
+    ]
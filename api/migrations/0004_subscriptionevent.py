@@ -0,0 +1,30 @@
+# Generated by Django 3.2.10 on 2026-10-18 07:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_subscription_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('created', 'Created'), ('plan_changed', 'Plan changed'), ('deactivated', 'Deactivated'), ('reactivated', 'Reactivated')], max_length=20)),
+                ('plan', models.CharField(choices=[('FREE', 'Free'), ('STANDARD', 'Standard'), ('PRO', 'Pro')], max_length=50)),
+                ('previous_plan', models.CharField(blank=True, choices=[('FREE', 'Free'), ('STANDARD', 'Standard'), ('PRO', 'Pro')], max_length=50, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('app', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='subscription_events', to='api.app')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='subscriptionevent',
+            index=models.Index(fields=['app', 'created_at', 'id'], name='api_subevent_app_idx'),
+        ),
+    ]
@@ -1,5 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+class LiveAppManager(models.Manager):
+    """Apps that have not been marked deleted (see api.deletion)."""
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class App(models.Model):
     name = models.CharField(max_length=100)
@@ -7,6 +14,21 @@ class App(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='apps')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set when the app is deleted asynchronously; the row is purged later in chunks.
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveAppManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # Listing a user's apps in creation order, and keyset pagination over it.
+            models.Index(fields=['user', 'created_at', 'id'], name='api_app_user_created_idx'),
+            # The purge only ever looks at apps waiting to be deleted.
+            models.Index(
+                fields=['deleted_at'], name='api_app_deleted_idx', condition=models.Q(deleted_at__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,6 +45,15 @@ class Plan(models.Model):
     def price(self):
         return self.planPrices[self.name]
 
+    @classmethod
+    def price_expression(cls, field='name'):
+        """SQL expression for the price of the plan named by ``field``, for aggregating in the database."""
+        return models.Case(
+            *[models.When(**{field: name}, then=models.Value(price)) for name, price in cls.planPrices.items()],
+            default=models.Value(0),
+            output_field=models.IntegerField(),
+        )
+
     def __str__(self):
         return f"{self.name} (${self.price})"
     
@@ -32,6 +63,105 @@ class Subscription(models.Model):
     active = models.BooleanField(default=True)
     start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField(null=True, blank=True)
+    # Bumped on every change so conditional GETs of the app notice plan changes.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Reporting over active subscriptions per plan. The ORM renders
+            # active=True as a bare boolean column, which SQLite can match
+            # against a partial index but not seek on in a composite one.
+            models.Index(fields=['plan', 'active'], name='api_sub_active_plan_idx', condition=models.Q(active=True)),
+            # Expiry sweeps only ever look at active subscriptions with an end date.
+            models.Index(
+                fields=['end_date'],
+                name='api_sub_expiry_idx',
+                condition=models.Q(active=True, end_date__isnull=False),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.app.name} - {self.plan.name}"
+
+class SubscriptionEvent(models.Model):
+    """Append-only history of subscription changes, written in batches by api.history."""
+    CREATED = 'created'
+    PLAN_CHANGED = 'plan_changed'
+    DEACTIVATED = 'deactivated'
+    REACTIVATED = 'reactivated'
+    KIND_CHOICES = [
+        (CREATED, 'Created'),
+        (PLAN_CHANGED, 'Plan changed'),
+        (DEACTIVATED, 'Deactivated'),
+        (REACTIVATED, 'Reactivated'),
+    ]
+
+    # No database constraint: history outlives deleted apps, and buffered
+    # events may be written after their app is gone.
+    app = models.ForeignKey(
+        App, on_delete=models.DO_NOTHING, db_constraint=False, related_name='subscription_events',
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    plan = models.CharField(max_length=50, choices=Plan.PLAN_CHOICES)
+    previous_plan = models.CharField(max_length=50, choices=Plan.PLAN_CHOICES, null=True, blank=True)
+    # When the change happened, not when the buffered event was written.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['app', 'created_at', 'id'], name='api_subevent_app_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.app_id} {self.kind} {self.plan}"
+
+class IdempotencyKey(models.Model):
+    """
+    An Idempotency-Key sent by a user and the response it produced (api.idempotency).
+
+    status_code is null while the first request with the key is still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and body the key was first used with.
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='api_idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='api_idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.key}"
+
+class AccountDeletion(models.Model):
+    """
+    An account marked for deletion. The user is deactivated at once; its apps
+    and finally the user row are purged in chunks by api.deletion.
+    """
+    # No database constraint: the row stays as a record once the user is gone.
+    user = models.OneToOneField(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='account_deletion',
+    )
+    requested_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} requested {self.requested_at}"
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row rewritten on the primary by ``manage.py sync_replica``. Its
+    age on a replica is that replica's lag (api.routing.replica_lag).
+    """
+    beat_at = models.DateTimeField()
 
     def __str__(self):
-        return f"{self.app.name} - {self.plan.name}"
\ No newline at end of file
+        return f"{self.beat_at}"
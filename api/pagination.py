@@ -0,0 +1,104 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+
+def model_position(obj):
+    return obj.created_at, obj.pk
+
+
+class KeysetPagination:
+    """
+    Cursor pagination over (created_at, id).
+
+    Each page is a single indexed range query, so the cost of a page does not
+    depend on how deep into the listing the client is.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'APP_LIST_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'APP_LIST_MAX_PAGE_SIZE', 1000)
+        self.next_cursor = None
+        self.request = None
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return cls.cursor_query_param in params or cls.page_size_query_param in params
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'A positive integer is required.'})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'A positive integer is required.'})
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, created_at, pk):
+        raw = '{}|{}'.format(created_at.isoformat(), pk)
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, value):
+        try:
+            raw = base64.urlsafe_b64decode(value.encode()).decode()
+            created_at, pk = raw.rsplit('|', 1)
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            created_at = None
+        if created_at is None:
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor.'})
+        return created_at, pk
+
+    @staticmethod
+    def filter_after(queryset, created_at, pk):
+        return queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        )
+
+    def get_page_queryset(self, queryset, cursor=None):
+        queryset = queryset.order_by('created_at', 'id')
+        if cursor:
+            queryset = self.filter_after(queryset, *self.decode_cursor(cursor))
+        return queryset
+
+    def paginate_queryset(self, queryset, request, position=None):
+        """
+        Return one page of ``queryset``. ``position`` maps an item to its
+        (created_at, id) pair; by default items are model instances.
+        """
+        if position is None:
+            position = model_position
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = self.get_page_queryset(queryset, request.query_params.get(self.cursor_query_param))
+
+        # Fetch one extra row to find out whether there is a next page.
+        page = list(queryset[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(*position(page[-1]))
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
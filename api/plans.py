@@ -0,0 +1,78 @@
+import threading
+
+from django.db import DatabaseError, connections
+from django.db.models.signals import post_delete, post_save
+
+from .models import Plan
+
+
+class PlanCatalog:
+    """
+    Process-local name -> Plan map.
+
+    There are only a handful of plan rows, so every worker loads them once and
+    resolves plan names in memory. Any save or delete of a Plan clears the map.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans = None
+
+    def _load(self):
+        plans = {}
+        for plan in Plan.objects.order_by('id'):
+            plans.setdefault(plan.name, plan)
+        return plans
+
+    def warm(self):
+        plans = self._load()
+        with self._lock:
+            self._plans = plans
+        return plans
+
+    def clear(self):
+        with self._lock:
+            self._plans = None
+
+    def get(self, name):
+        plans = self._plans
+        if plans is None:
+            plans = self.warm()
+        plan = plans.get(name)
+        if plan is None:
+            # Same fallback the views used to have: create a missing plan row.
+            # The post_save signal clears the map, so the next lookup reloads.
+            plan = Plan.objects.create(name=name)
+        return plan
+
+    def name_for(self, plan_id):
+        """Name of the plan with primary key ``plan_id``, or None if it is not in the catalog."""
+        plans = self._plans
+        if plans is None:
+            plans = self.warm()
+        for plan in plans.values():
+            if plan.pk == plan_id:
+                return plan.name
+        return None
+
+
+plan_catalog = PlanCatalog()
+
+
+def clear_plan_catalog(sender, **kwargs):
+    plan_catalog.clear()
+
+
+def connect_signals():
+    post_save.connect(clear_plan_catalog, sender=Plan, dispatch_uid='api.plans.clear_on_save')
+    post_delete.connect(clear_plan_catalog, sender=Plan, dispatch_uid='api.plans.clear_on_delete')
+
+
+def warm_plan_catalog():
+    """Load the catalog at process start. Tolerates a database that has not been migrated yet."""
+    try:
+        plan_catalog.warm()
+    except DatabaseError:
+        pass
+    finally:
+        connections.close_all()
@@ -0,0 +1,38 @@
+from django.db.models import Count, F, Sum
+
+from .models import Plan, Subscription
+
+
+def plan_report():
+    """
+    Active subscriptions and monthly recurring revenue per plan, from one
+    GROUP BY over active subscriptions. Plans without subscriptions are
+    reported with zeros.
+    """
+    rows = (
+        Subscription.objects.filter(active=True)
+        .values('plan__name')
+        .annotate(active_subscriptions=Count('id'), mrr=Sum(Plan.price_expression('plan__name')))
+        .order_by()
+    )
+    found = {row['plan__name']: row for row in rows}
+    report = []
+    for name, _ in Plan.PLAN_CHOICES:
+        row = found.get(name, {})
+        report.append({
+            'plan': name,
+            'price': Plan.planPrices[name],
+            'active_subscriptions': row.get('active_subscriptions', 0),
+            'mrr': row.get('mrr') or 0,
+        })
+    return report
+
+
+def user_spend_report(limit):
+    """The ``limit`` users with the highest monthly spend on active subscriptions."""
+    return list(
+        Subscription.objects.filter(active=True)
+        .values(user_id=F('app__user_id'), username=F('app__user__username'))
+        .annotate(active_subscriptions=Count('id'), monthly_spend=Sum(Plan.price_expression('plan__name')))
+        .order_by('-monthly_spend', 'user_id')[:limit]
+    )
@@ -0,0 +1,142 @@
+"""
+Read replica routing (DATABASE_ROUTERS, DATABASE_REPLICAS).
+
+Writes always go to the primary ("default"). Reads go to a replica only
+while ``read_replica`` is set, which api.middleware.ReplicaRoutingMiddleware
+does for GET/HEAD/OPTIONS requests. Everything else (writes, management
+commands, background threads) reads from the primary, as do reads inside a
+transaction and reads of the models authentication depends on, so a new
+token or password works on the very next request.
+
+The middleware picks one replica per request, so every read in it, such as
+the ETag aggregate and the listing it describes, sees the same sync point.
+It picks among replicas whose newest heartbeat is at most
+READ_REPLICAS['MAX_LAG'] seconds old and no older than the client's last
+write, so a client only reads from replicas that already have its writes.
+The heartbeat is the ReplicaHeartbeat row ``manage.py sync_replica``
+rewrites on the primary.
+For local development it also copies the primary into SQLite replica files
+with the SQLite backup API, standing in for real replication.
+"""
+import contextvars
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+# Alias of the replica the current request reads from, or None for the primary.
+read_replica = contextvars.ContextVar('read_replica', default=None)
+
+PRIMARY = 'default'
+PRIMARY_ONLY_MODELS = {'auth.user', 'authtoken.token'}
+
+
+class ReplicaLag:
+    """Newest heartbeat of each replica, cached for READ_REPLICAS['LAG_TTL'] seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def load(self, alias):
+        from .models import ReplicaHeartbeat
+
+        try:
+            beat_at = ReplicaHeartbeat.objects.using(alias).filter(pk=1).values_list('beat_at', flat=True).first()
+        except DatabaseError:
+            # Not synced yet, or unreachable.
+            return None
+        return None if beat_at is None else beat_at.timestamp()
+
+    def heartbeat(self, alias):
+        """The replica's newest heartbeat as a time.time() value, or None."""
+        with self._lock:
+            cached = self._values.get(alias)
+            if cached is not None and time.monotonic() < cached[1]:
+                return cached[0]
+        beat = self.load(alias)
+        with self._lock:
+            self._values[alias] = (beat, time.monotonic() + settings.READ_REPLICAS['LAG_TTL'])
+        return beat
+
+    def get(self, alias):
+        """The replica's lag in seconds, or None if it has no heartbeat."""
+        beat = self.heartbeat(alias)
+        return None if beat is None else max(time.time() - beat, 0.0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+replica_lag = ReplicaLag()
+
+
+def healthy_replicas(since=0.0):
+    """Replicas lagging at most MAX_LAG seconds whose heartbeat is no older than ``since``."""
+    healthy = []
+    for alias in settings.DATABASE_REPLICAS:
+        beat = replica_lag.heartbeat(alias)
+        if beat is not None and beat >= since and time.time() - beat <= settings.READ_REPLICAS['MAX_LAG']:
+            healthy.append(alias)
+    return healthy
+
+
+def choose_replica(since=0.0):
+    """One of healthy_replicas(since) at random, or None."""
+    replicas = healthy_replicas(since)
+    return random.choice(replicas) if replicas else None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_replica.get()
+        if alias is None or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from the database the instance came from.
+            return None
+        if connections[PRIMARY].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Even for instances read from a replica.
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def write_heartbeat():
+    # The router is loaded with the settings, before the app registry.
+    from .models import ReplicaHeartbeat
+
+    ReplicaHeartbeat.objects.using(PRIMARY).update_or_create(pk=1, defaults={'beat_at': timezone.now()})
+
+
+def copy_to_replica(alias):
+    """Copy the primary SQLite database into the replica's file, as one transaction on the replica."""
+    source, target = connections[PRIMARY], connections[alias]
+    if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+        raise DatabaseError('Only SQLite replicas can be copied; use the database\'s own replication')
+    source.ensure_connection()
+    replica = sqlite3.connect(str(target.settings_dict['NAME']))
+    try:
+        source.connection.backup(replica)
+    finally:
+        replica.close()
@@ -1,28 +1,191 @@
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth.models import User
-from .models import Plan, App, Subscription
+from .instrumentation import serializer_timer
+from .models import Plan, App, Subscription, SubscriptionEvent
 
-class UserSerializer(serializers.ModelSerializer):
+
+class TimedSerializerMixin:
+    # Counts building .data towards the request's serializer time (api.middleware).
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta(object):
         model = User
         fields = ['id', 'username', 'password', 'email']
 
-class PlanSerializer(serializers.ModelSerializer):
+class PlanSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Plan
         fields = ['id', 'name', 'price']
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     plan = PlanSerializer(read_only=True)
 
     class Meta:
         model = Subscription
         fields = ['id', 'plan', 'active', 'start_date', 'end_date']
 
-class AppSerializer(serializers.ModelSerializer):
+class AppSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     subscription = SubscriptionSerializer(read_only=True)
 
     class Meta:
         model = App
         fields = ['id', 'name', 'description', 'created_at', 'updated_at', 'subscription']
         read_only_fields = ['user', 'created_at', 'updated_at']
+        list_serializer_class = TimedListSerializer
+
+class SubscriptionEventSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = SubscriptionEvent
+        fields = ['id', 'kind', 'plan', 'previous_plan', 'created_at']
+        list_serializer_class = TimedListSerializer
+
+
+# Read-only fast path for large listings. It produces the same structure as
+# AppSerializer(many=True).data from a values_list() projection, without
+# building model instances or running DRF fields per row.
+APP_FIELDS = ('id', 'name', 'description', 'created_at', 'updated_at')
+
+SUBSCRIPTION_ROW_FIELDS = (
+    'subscription__id', 'subscription__plan__id', 'subscription__plan__name',
+    'subscription__active', 'subscription__start_date', 'subscription__end_date',
+)
+
+APP_ROW_FIELDS = APP_FIELDS + SUBSCRIPTION_ROW_FIELDS
+
+DATETIME_FIELDS = {'created_at', 'updated_at'}
+
+
+class AppFieldset:
+    """
+    A sparse app representation chosen with ``?fields=`` and ``?expand=``:
+    the named app ``fields``, plus the subscription if ``expand`` is set.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    expansions = ('subscription',)
+
+    def __init__(self, fields=APP_FIELDS, expand=False):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_query_params(cls, params):
+        """
+        The fieldset a request asks for, or None for the full representation
+        (no ``?fields=``; the subscription is then always included).
+        """
+        expand = cls.parse_list(params, cls.expand_query_param, cls.expansions)
+        if cls.fields_query_param not in params:
+            return None
+        fields = cls.parse_list(params, cls.fields_query_param, APP_FIELDS)
+        if not fields:
+            raise ValidationError({cls.fields_query_param: 'At least one field is required.'})
+        return cls(fields, 'subscription' in expand)
+
+    @staticmethod
+    def parse_list(params, name, choices):
+        names = {value.strip() for value in params.get(name, '').split(',') if value.strip()}
+        unknown = names.difference(choices)
+        if unknown:
+            raise ValidationError({name: 'Unknown: {}. Choose from: {}.'.format(
+                ', '.join(sorted(unknown)), ', '.join(choices),
+            )})
+        # In the order of the full representation.
+        return tuple(choice for choice in choices if choice in names)
+
+    @property
+    def columns(self):
+        # id and created_at are always read: they are the keyset position.
+        columns = set(self.fields) | {'id', 'created_at'}
+        if self.expand:
+            columns.update(SUBSCRIPTION_ROW_FIELDS)
+        return columns
+
+
+def app_rows(queryset, fieldset=None):
+    """
+    Project ``queryset`` for serialize_app_rows(). With a sparse ``fieldset``
+    only its columns are selected, and the subscription and plan are joined
+    only when it is expanded.
+    """
+    if fieldset is None:
+        return queryset.values_list(*APP_ROW_FIELDS)
+    return queryset.values(*fieldset.columns)
+
+
+def app_row_position(row):
+    # (created_at, id), for KeysetPagination.
+    if isinstance(row, dict):
+        return row['created_at'], row['id']
+    return row[3], row[0]
+
+
+def serialize_app_rows(rows, fieldset=None):
+    with serializer_timer():
+        if fieldset is None:
+            return _serialize_app_rows(rows)
+        return _serialize_sparse_app_rows(rows, fieldset)
+
+
+# Same output as serializers.DateTimeField with the default ISO 8601 format.
+def format_datetime(value, tz):
+    if value is None:
+        return None
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def subscription_data(subscription_id, plan_id, plan_name, active, start_date, end_date, tz):
+    if subscription_id is None:
+        return None
+    return {
+        'id': subscription_id,
+        'plan': {'id': plan_id, 'name': plan_name, 'price': Plan.planPrices[plan_name]},
+        'active': active,
+        'start_date': format_datetime(start_date, tz),
+        'end_date': format_datetime(end_date, tz),
+    }
+
+
+def _serialize_app_rows(rows):
+    tz = timezone.get_current_timezone()
+    data = []
+    for (pk, name, description, created_at, updated_at,
+         subscription_id, plan_id, plan_name, active, start_date, end_date) in rows:
+        data.append({
+            'id': pk,
+            'name': name,
+            'description': description,
+            'created_at': format_datetime(created_at, tz),
+            'updated_at': format_datetime(updated_at, tz),
+            'subscription': subscription_data(
+                subscription_id, plan_id, plan_name, active, start_date, end_date, tz,
+            ),
+        })
+    return data
+
+
+def _serialize_sparse_app_rows(rows, fieldset):
+    tz = timezone.get_current_timezone()
+    data = []
+    for row in rows:
+        item = {}
+        for name in fieldset.fields:
+            item[name] = format_datetime(row[name], tz) if name in DATETIME_FIELDS else row[name]
+        if fieldset.expand:
+            item['subscription'] = subscription_data(*(row[name] for name in SUBSCRIPTION_ROW_FIELDS), tz)
+        data.append(item)
+    return data
@@ -0,0 +1,99 @@
+"""
+State shared by every worker process on the host.
+
+A SharedTable is a fixed array of struct slots in a memory-mapped file,
+guarded by fcntl locks, so a write by one worker, or by a management
+command, is seen by all the others on their next read. The login throttle's
+token buckets (api.throttling) are one such table.
+
+SharedStamps tables (SHARED_STATE['PATH'] plus the table name) hold
+SHARED_STATE['SLOTS'] per-key wall-clock timestamps. Keys are hashed onto
+slots and a slot only ever moves forward, so keys that share a slot may read
+a newer stamp than their own but never an older one. They are only used
+where a stamp that is too new is safe: token revocations (api.authentication)
+turn it into a cache miss, and replica pins (api.middleware) into a read from
+the primary.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+class SharedTable:
+    slot = None  # struct.Struct of one slot, set by subclasses.
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        size = slots * self.slot.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            with self.locked(fcntl.LOCK_EX):
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextmanager
+    def locked(self, mode, offset=0, length=0):
+        """Hold an fcntl lock on ``length`` bytes from ``offset``; 0 locks the whole file."""
+        # fcntl locks belong to the process, so threads also need a local lock.
+        with self._lock:
+            fcntl.lockf(self._fd, mode, length, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def clear(self):
+        with self.locked(fcntl.LOCK_EX):
+            self._map[:] = bytes(len(self._map))
+
+
+class SharedStamps(SharedTable):
+    slot = struct.Struct('<d')
+
+    def offset(self, key):
+        return key_hash(key) % self.slots * self.slot.size
+
+    def get(self, key):
+        """The newest stamp set for ``key``, or 0.0."""
+        offset = self.offset(key)
+        with self.locked(fcntl.LOCK_SH, offset, self.slot.size):
+            return self.slot.unpack_from(self._map, offset)[0]
+
+    def touch(self, key, stamp):
+        """Move ``key``'s stamp forward to ``stamp``."""
+        offset = self.offset(key)
+        with self.locked(fcntl.LOCK_EX, offset, self.slot.size):
+            if self.slot.unpack_from(self._map, offset)[0] < stamp:
+                self.slot.pack_into(self._map, offset, stamp)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(cls, path, slots):
+    """This process's ``cls`` table for the file at ``path``, opened on first use."""
+    # Keyed by pid too: a forked worker opens its own descriptor.
+    key = (os.getpid(), cls, path, slots)
+    with _tables_lock:
+        if key not in _tables:
+            _tables[key] = cls(path, slots)
+        return _tables[key]
+
+
+def get_stamps(name):
+    options = settings.SHARED_STATE
+    return get_table(SharedStamps, '{}-{}'.format(options['PATH'], name), options['SLOTS'])
@@ -1,12 +1,76 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from prometheus_client import CollectorRegistry
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from django.conf import settings
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.db import DatabaseError, connections, router, transaction
+from django.test import AsyncClient, AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.authtoken.models import Token
-from .models import App, Plan, Subscription
+from rest_framework.exceptions import AuthenticationFailed
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from .models import AccountDeletion, App, IdempotencyKey, Plan, ReplicaHeartbeat, Subscription, SubscriptionEvent
+from . import async_views, metrics, middleware, urls, views
+from .benchmark import QUERY_BUDGETS, EndpointBenchmark, check_budgets
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import AppSerializer, app_rows, serialize_app_rows
+from .authentication import CachedTokenAuthentication, token_cache
+from .bulk import bulk_create_apps
+from .cache import response_cache
+from .conditional import app_list_etag
+from .deletion import mark_account_deleted, purge_deleted
+from .expiry import expire_subscriptions, expired_subscriptions
+from .history import EventBuffer, event_buffer, make_event
+from .instrumentation import JSONFormatter
+from .plans import plan_catalog
+from .routing import choose_replica, read_replica, replica_lag
+from .shared import get_stamps
+from .throttling import SharedTokenBuckets, get_buckets
+from .warmup import warm_up
+
+
+def use_temporary_path(test, setting, **options):
+    """
+    Point the shared file of ``setting`` (LOGIN_THROTTLE, SHARED_STATE) at a
+    temporary directory for ``test``, so tests never touch the files of a
+    server running on the same host.
+    """
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory)
+    options = dict(getattr(settings, setting), PATH=os.path.join(directory, 'shared'), **options)
+    override = override_settings(**{setting: options})
+    override.enable()
+    test.addCleanup(override.disable)
+    return options
+
 
 class LoginAPITestCase(TestCase):
     def setUp(self):
+        use_temporary_path(self, 'SHARED_STATE')
+        use_temporary_path(self, 'LOGIN_THROTTLE')
+        get_buckets().clear()
         self.client = APIClient()
         self.user = User.objects.create_user(username='testuser2', password='testpassword')
         self.login_url = '/login'
@@ -219,3 +283,1718 @@ class AppAPITestCase(TestCase):
         other_app = App.objects.create(user=other_user, name='Other App')
         response = self.client.get(self.app_detail_url.format(other_app.id))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+@override_settings(APP_RESPONSE_CACHE={'ENABLED': False})
+class AppListPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.app_url = '/app/'
+        self.plan = Plan.objects.create(name='FREE')
+
+    def create_apps(self, count):
+        for i in range(count):
+            app = App.objects.create(user=self.user, name='App {}'.format(i))
+            Subscription.objects.create(app=app, plan=self.plan)
+
+    def test_query_count_is_constant(self):
+        self.create_apps(2)
+        # Authentication is served from the token cache after the first request,
+        # leaving the conditional GET aggregate and the joined listing query.
+        self.client.get(self.app_url)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.app_url)
+        self.assertEqual(len(response.data), 2)
+
+        self.create_apps(10)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.app_url)
+        self.assertEqual(len(response.data), 12)
+        self.assertEqual(response.data[0]['subscription']['plan']['name'], 'FREE')
+
+    def test_cursor_pagination(self):
+        self.create_apps(5)
+        response = self.client.get(self.app_url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [app['name'] for app in response.data['results']]
+        self.assertEqual(names, ['App 0', 'App 1'])
+
+        while response.data['next']:
+            with self.assertNumQueries(2):
+                response = self.client.get(response.data['next'])
+            names += [app['name'] for app in response.data['results']]
+        self.assertEqual(names, ['App {}'.format(i) for i in range(5)])
+
+    def test_page_size_is_capped(self):
+        self.create_apps(3)
+        with self.settings(APP_LIST_MAX_PAGE_SIZE=2):
+            response = self.client.get(self.app_url, {'page_size': 50})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.app_url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.app_url, {'page_size': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PlanCatalogTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.free_plan = Plan.objects.create(name='FREE')
+        self.pro_plan = Plan.objects.create(name='PRO')
+        plan_catalog.warm()
+
+    def assertNoPlanQueries(self, queries):
+        for query in queries:
+            self.assertNotIn('"api_plan"', query['sql'])
+
+    def test_app_create_does_not_query_plans(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/app/', {'name': 'New App', 'description': 'meaow'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNoPlanQueries(queries)
+        self.assertEqual(Subscription.objects.get().plan, self.free_plan)
+
+    def test_subscription_update_does_not_query_plans(self):
+        app = App.objects.create(user=self.user, name='Test App')
+        Subscription.objects.create(app=app, plan=self.free_plan)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put('/app/sub/{}/'.format(app.id), {'plan': 'PRO'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNoPlanQueries(queries)
+        self.assertEqual(Subscription.objects.get().plan, self.pro_plan)
+
+    def test_plan_changes_invalidate_catalog(self):
+        self.assertEqual(plan_catalog.get('PRO'), self.pro_plan)
+        old_pro_plan_id = self.pro_plan.pk
+        self.pro_plan.delete()
+        standard_plan = Plan.objects.create(name='STANDARD')
+        self.assertEqual(plan_catalog.get('STANDARD'), standard_plan)
+        new_pro_plan = plan_catalog.get('PRO')
+        self.assertNotEqual(new_pro_plan.pk, old_pro_plan_id)
+        self.assertTrue(Plan.objects.filter(pk=new_pro_plan.pk).exists())
+
+
+@override_settings(APP_RESPONSE_CACHE={'ENABLED': False})
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        self.shared_state = use_temporary_path(self, 'SHARED_STATE')
+        token_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_cached_token_skips_auth_query(self):
+        with self.assertNumQueries(3):
+            self.client.get('/app/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_evicts_token(self):
+        self.client.get('/app/')
+        response = self.client.post('/logout')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_change_password_evicts_token(self):
+        self.client.get('/app/')
+        response = self.client.post('/change_pass', {'old_password': 'testpassword', 'new_password': 'newpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_token = response.data['new_token']
+        response = self.client.get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + new_token)
+        response = self.client.get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_revocation_from_another_process(self):
+        self.client.get('/app/')
+        script = (
+            'import sys, time; from api.shared import SharedStamps; '
+            'SharedStamps(sys.argv[1] + "-revocations", int(sys.argv[2])).touch(sys.argv[3], time.time())'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='backend_app.settings')
+        subprocess.run(
+            [sys.executable, '-c', script, self.shared_state['PATH'], str(self.shared_state['SLOTS']), self.token.key],
+            cwd=settings.BASE_DIR, env=env, check=True,
+        )
+        # The worker goes back to the database, where the token is still valid.
+        with self.assertNumQueries(3):
+            response = self.client.get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(2):
+            self.client.get('/app/')
+        get_stamps('revocations').touch(self.token.key, time.time())
+        Token.objects.filter(pk=self.token.pk).delete()
+        self.assertEqual(self.client.get('/app/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_loaded_before_commit_is_revoked(self):
+        authentication = CachedTokenAuthentication()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                token_cache.evict_user(self.user)
+                # A worker loading the token before the delete commits caches it.
+                authentication.authenticate_credentials(self.token.key)
+                Token.objects.filter(user=self.user).delete()
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.token.key)
+
+    def test_entries_expire(self):
+        token_cache.ttl, ttl = 0, token_cache.ttl
+        try:
+            self.client.get('/app/')
+            with self.assertNumQueries(3):
+                self.client.get('/app/')
+        finally:
+            token_cache.ttl = ttl
+
+    def test_cache_is_bounded(self):
+        token_cache.max_size, max_size = 1, token_cache.max_size
+        try:
+            other = User.objects.create_user(username='otheruser', password='otherpassword')
+            other_token = Token.objects.create(user=other)
+            self.client.get('/app/')
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + other_token.key)
+            self.client.get('/app/')
+            self.assertIsNone(token_cache.get(self.token.key))
+            self.assertIsNotNone(token_cache.get(other_token.key))
+        finally:
+            token_cache.max_size = max_size
+
+class AppBulkCreateTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.bulk_url = '/app/bulk/'
+        self.free_plan = Plan.objects.create(name='FREE')
+        plan_catalog.warm()
+
+    def payload(self, count, offset=0):
+        return [{'name': 'App {}'.format(i), 'description': 'bulk'} for i in range(offset, offset + count)]
+
+    def test_bulk_create(self):
+        other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+        App.objects.create(user=other_user, name='Other App')
+
+        response = self.client.post(self.bulk_url, self.payload(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([app['name'] for app in response.data], ['App 0', 'App 1', 'App 2'])
+        for app in response.data:
+            self.assertEqual(app['subscription']['plan']['name'], 'FREE')
+        apps = App.objects.filter(user=self.user)
+        self.assertEqual(apps.count(), 3)
+        self.assertEqual(Subscription.objects.filter(app__user=self.user, plan=self.free_plan).count(), 3)
+        self.assertEqual(sorted(app['id'] for app in response.data), sorted(apps.values_list('id', flat=True)))
+
+    def test_query_count_does_not_grow_with_batch(self):
+        self.client.get('/app/')
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.bulk_url, self.payload(2), format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.bulk_url, self.payload(50, offset=2), format='json')
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Subscription.objects.count(), 52)
+
+    def test_errors_are_reported_per_item(self):
+        payload = self.payload(3)
+        payload[1] = {'description': 'missing name'}
+        response = self.client.post(self.bulk_url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('name', response.data[1])
+        self.assertEqual(App.objects.count(), 0)
+
+    def test_batch_size_limit(self):
+        with self.settings(APP_BULK_MAX_ITEMS=2):
+            response = self.client.post(self.bulk_url, self.payload(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(App.objects.count(), 0)
+
+    def test_payload_must_be_a_list(self):
+        response = self.client.post(self.bulk_url, {'name': 'App'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class SubscriptionBulkUpdateTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.bulk_url = '/app/sub/bulk/'
+        self.free_plan = Plan.objects.create(name='FREE')
+        self.pro_plan = Plan.objects.create(name='PRO')
+        plan_catalog.warm()
+        self.apps = [App.objects.create(user=self.user, name='App {}'.format(i)) for i in range(3)]
+        for app in self.apps[:2]:
+            Subscription.objects.create(app=app, plan=self.free_plan, active=False)
+        other_user = User.objects.create_user(username='otheruser', password='otherpassword')
+        self.other_app = App.objects.create(user=other_user, name='Other App')
+        Subscription.objects.create(app=self.other_app, plan=self.free_plan)
+
+    def test_change_selected_apps(self):
+        data = {'plan': 'PRO', 'apps': [self.apps[0].id, self.apps[2].id, self.other_app.id]}
+        response = self.client.put(self.bulk_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['plan']['name'], 'PRO')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['not_found'], [self.other_app.id])
+        self.assertEqual(Subscription.objects.get(app=self.apps[0]).plan, self.pro_plan)
+        self.assertTrue(Subscription.objects.get(app=self.apps[0]).active)
+        self.assertEqual(Subscription.objects.get(app=self.apps[1]).plan, self.free_plan)
+        self.assertEqual(Subscription.objects.get(app=self.apps[2]).plan, self.pro_plan)
+        self.assertEqual(Subscription.objects.get(app=self.other_app).plan, self.free_plan)
+
+    def test_change_all_apps(self):
+        response = self.client.put(self.bulk_url, {'plan': 'PRO', 'apps': 'all'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Subscription.objects.filter(app__user=self.user, plan=self.pro_plan, active=True).count(), 3)
+        self.assertEqual(Subscription.objects.get(app=self.other_app).plan, self.free_plan)
+
+    def test_single_update_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(self.bulk_url, {'plan': 'PRO', 'apps': 'all'}, format='json')
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+
+    def test_invalid_requests(self):
+        response = self.client.put(self.bulk_url, {'plan': 'INVALID', 'apps': 'all'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(self.bulk_url, {'plan': 'PRO', 'apps': ['x']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(self.bulk_url, {'plan': 'PRO'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncAuthViewsTestCase(TestCase):
+    def setUp(self):
+        use_temporary_path(self, 'SHARED_STATE')
+        use_temporary_path(self, 'LOGIN_THROTTLE')
+        get_buckets().clear()
+        token_cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create_user(username='testuser2', password='testpassword')
+
+    def post(self, view, data, token=None):
+        extra = {}
+        if token:
+            extra['authorization'] = 'Token ' + token
+        request = self.factory.post('/', json.dumps(data), content_type='application/json', **extra)
+        return view(request)
+
+    async def test_login(self):
+        response = await self.post(async_views.login, {'username': 'testuser2', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(data['user']['username'], 'testuser2')
+        self.assertIn('token', data)
+
+    async def test_login_failures(self):
+        response = await self.post(async_views.login, {'username': 'testuser2', 'password': 'wrongpassword'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.post(async_views.login, {'username': 'nonexistentuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.post(async_views.login, {'username': 'testuser2'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_signup(self):
+        data = {'username': 'newuser', 'password': 'newpassword', 'email': 'newuser@example.com'}
+        response = await self.post(async_views.signup, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('token', json.loads(response.content))
+        response = await self.post(async_views.login, {'username': 'newuser', 'password': 'newpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_signup_with_existing_username(self):
+        data = {'username': 'testuser2', 'password': 'newpassword', 'email': 'newuser@example.com'}
+        response = await self.post(async_views.signup, data)
+        self.assertIn('username', json.loads(response.content))
+
+    async def test_change_password(self):
+        response = await self.post(async_views.login, {'username': 'testuser2', 'password': 'testpassword'})
+        token = json.loads(response.content)['token']
+        data = {'old_password': 'testpassword', 'new_password': 'newpassword'}
+        response = await self.post(async_views.change_password, data, token=token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(json.loads(response.content)['new_token'], token)
+        response = await self.post(async_views.change_password, data, token=token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.post(async_views.login, {'username': 'testuser2', 'password': 'newpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SignupWriteTestCase(TestCase):
+    def test_signup_inserts_user_once(self):
+        data = {'username': 'newuser', 'password': 'newpassword', 'email': 'newuser@example.com'}
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post('/signup', data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(User.objects.get(username='newuser').check_password('newpassword'))
+        self.assertEqual(Token.objects.get(user__username='newuser').key, response.data['token'])
+
+
+class ImportUsersCommandTestCase(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='existing', password='password')
+
+    def write_file(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_ndjson(self):
+        path = self.write_file('.ndjson', '\n'.join([
+            json.dumps({'username': 'alice', 'password': 'alicepassword', 'email': 'alice@example.com'}),
+            json.dumps({'username': 'bob', 'password': 'bobpassword'}),
+            json.dumps({'username': 'existing', 'password': 'password'}),
+            json.dumps({'username': 'nopassword'}),
+            'not json',
+        ]))
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_users', path, workers=2, stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 2 users', stdout.getvalue())
+        self.assertIn('skipped 1 existing and 2 invalid rows', stdout.getvalue())
+        self.assertIn('Line 4', stderr.getvalue())
+        self.assertTrue(User.objects.get(username='alice').check_password('alicepassword'))
+        self.assertEqual(User.objects.get(username='alice').email, 'alice@example.com')
+        self.assertTrue(User.objects.get(username='bob').check_password('bobpassword'))
+
+    def test_import_csv(self):
+        path = self.write_file('.csv', 'username,password,email\ncarol,carolpassword,carol@example.com\ncarol,again,\n')
+        stdout = StringIO()
+        call_command('import_users', path, workers=1, batch_size=1, stdout=stdout)
+        self.assertIn('Imported 1 users', stdout.getvalue())
+        self.assertTrue(User.objects.get(username='carol').check_password('carolpassword'))
+
+
+class SQLiteProductionProfileTestCase(SimpleTestCase):
+    alias = 'concurrency'
+    workers = 8
+    operations = 40
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.settings[self.alias] = dict(
+            connections['default'].settings_dict,
+            ENGINE='backend_app.sqlite_backend',
+            NAME=os.path.join(directory, 'db.sqlite3'),
+            CONN_MAX_AGE=600,
+            OPTIONS={'pragmas': settings.SQLITE_PRAGMAS, 'transaction_mode': 'IMMEDIATE'},
+        )
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(connections.__delitem__, self.alias)
+        self.addCleanup(connections[self.alias].close)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, worker INTEGER, value INTEGER)')
+
+    def test_pragmas_are_applied(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def run_worker(self, worker, errors):
+        try:
+            for i in range(self.operations):
+                if i % 2:
+                    # Read-then-write: the pattern that fails under deferred transactions.
+                    with transaction.atomic(using=self.alias), connections[self.alias].cursor() as cursor:
+                        cursor.execute('SELECT COALESCE(MAX(value), 0) FROM counter WHERE worker = %s', [worker])
+                        value = cursor.fetchone()[0]
+                        cursor.execute('INSERT INTO counter (worker, value) VALUES (%s, %s)', [worker, value + 1])
+                else:
+                    with connections[self.alias].cursor() as cursor:
+                        cursor.execute('SELECT COUNT(*) FROM counter')
+                        cursor.fetchone()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections[self.alias].close()
+
+    def test_concurrent_reads_and_writes(self):
+        errors = []
+        threads = [threading.Thread(target=self.run_worker, args=(worker, errors)) for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT worker, COUNT(*), MAX(value) FROM counter GROUP BY worker')
+            rows = cursor.fetchall()
+        writes = self.operations // 2
+        self.assertEqual(sorted(rows), [(worker, writes, writes) for worker in range(self.workers)])
+
+
+class QueryPlanMixin:
+    """Fails a test when SQLite plans a queryset as a full table scan."""
+
+    def get_query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[3] for row in cursor.fetchall()]
+
+    def assertNoFullTableScan(self, queryset):
+        tables = set(connection.introspection.table_names())
+        plan = self.get_query_plan(queryset)
+        for detail in plan:
+            # A scan over a covering index reads only the index, never the table.
+            match = re.match(r'SCAN (\w+)', detail)
+            if match and match.group(1) in tables and 'COVERING INDEX' not in detail:
+                self.fail('Full table scan on {}: {}\n{}'.format(match.group(1), '\n'.join(plan), queryset.query))
+
+
+class QueryPlanTestCase(QueryPlanMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.app = App.objects.create(user=self.user, name='Test App')
+
+    def test_app_list(self):
+        self.assertNoFullTableScan(views.AppListCreateView().get_queryset(self.user))
+
+    def test_app_list_pages(self):
+        paginator = KeysetPagination()
+        apps = views.AppListCreateView().get_queryset(self.user)
+        self.assertNoFullTableScan(paginator.get_page_queryset(apps))
+        self.assertNoFullTableScan(paginator.get_page_queryset(apps, paginator.encode_cursor(self.app.created_at, self.app.pk)))
+        plan = self.get_query_plan(paginator.get_page_queryset(apps))
+        self.assertFalse([detail for detail in plan if 'TEMP B-TREE' in detail], plan)
+
+    def test_app_detail(self):
+        self.assertNoFullTableScan(views.AppDetailView().get_queryset(self.user).filter(pk=self.app.pk))
+
+    def test_helper_detects_full_scans(self):
+        with self.assertRaises(AssertionError):
+            self.assertNoFullTableScan(App.objects.filter(name='Test App'))
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.free_plan = Plan.objects.create(name='FREE')
+        self.pro_plan = Plan.objects.create(name='PRO')
+        self.app = App.objects.create(user=self.user, name='Test App')
+        Subscription.objects.create(app=self.app, plan=self.free_plan)
+        self.urls = ['/app/', '/app/{}/'.format(self.app.id)]
+
+    def assertNotModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_skips_serialization(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # Only the validator aggregate runs; authentication is cached.
+            with self.assertNumQueries(1):
+                self.assertNotModified(url, response['ETag'])
+
+    def test_edit_in_the_same_second_is_not_hidden(self):
+        for url in self.urls:
+            self.assertNotIn('Last-Modified', self.client.get(url))
+        self.client.put(self.urls[1], {'name': 'v1'})
+        self.client.get(self.urls[1])
+        self.client.put(self.urls[1], {'name': 'v2'})
+        response = self.client.get(self.urls[1], HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'v2')
+
+    def test_delete_changes_list_validator(self):
+        other = App.objects.create(user=self.user, name='Other App')
+        third = App.objects.create(user=self.user, name='Third App')
+        for path, extra in [('/app/{}/'.format(other.pk), {}),
+                            ('/app/{}/'.format(third.pk), {'HTTP_PREFER': 'respond-async'})]:
+            response = self.client.get('/app/')
+            self.client.delete(path, **extra)
+            self.assertModified('/app/', response['ETag'])
+            response = self.client.get('/app/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([app['name'] for app in response.data], ['Test App'])
+
+    def test_app_update_changes_validator(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        self.client.put(self.urls[1], {'name': 'Updated App'})
+        for url, etag in zip(self.urls, etags):
+            self.assertModified(url, etag)
+
+    def test_plan_change_changes_validator(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        self.client.put('/app/sub/{}/'.format(self.app.id), {'plan': 'PRO'})
+        for url, etag in zip(self.urls, etags):
+            self.assertModified(url, etag)
+
+    def test_bulk_plan_change_and_unsubscribe_change_validator(self):
+        etag = self.client.get(self.urls[1])['ETag']
+        self.client.put('/app/sub/bulk/', {'plan': 'PRO', 'apps': 'all'}, format='json')
+        self.assertModified(self.urls[1], etag)
+        etag = self.client.get(self.urls[1])['ETag']
+        self.client.delete('/app/sub/{}/'.format(self.app.id))
+        self.assertModified(self.urls[1], etag)
+        self.assertFalse(Subscription.objects.get(app=self.app).active)
+
+    def test_list_validator_changes_on_create_and_delete(self):
+        etag = self.client.get(self.urls[0])['ETag']
+        self.client.post('/app/', {'name': 'New App', 'description': 'meaow'})
+        self.assertModified(self.urls[0], etag)
+        etag = self.client.get(self.urls[0])['ETag']
+        self.client.delete(self.urls[1])
+        self.assertModified(self.urls[0], etag)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        response_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        Plan.objects.create(name='FREE')
+        self.app = App.objects.create(user=self.user, name='Test App')
+        Subscription.objects.create(app=self.app, plan=plan_catalog.get('FREE'))
+        self.urls = ['/app/', '/app/{}/'.format(self.app.id), '/app/?page_size=10']
+
+    def assertCacheStatus(self, url, cache_status):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], cache_status)
+        return response
+
+    def test_hits_after_first_read(self):
+        before = {result: metrics.registry.get_sample_value('api_response_cache_lookups_total', {'result': result}) or 0
+                  for result in ['hit', 'miss']}
+        for url in self.urls:
+            first = self.assertCacheStatus(url, 'MISS')
+            # Only the validator aggregate runs on a hit.
+            with self.assertNumQueries(1):
+                second = self.assertCacheStatus(url, 'HIT')
+            self.assertEqual(first.content, second.content)
+        self.assertEqual(response_cache.stats(), {'hits': 3, 'misses': 3})
+        for result in ['hit', 'miss']:
+            self.assertEqual(
+                metrics.registry.get_sample_value('api_response_cache_lookups_total', {'result': result}),
+                before[result] + 3,
+            )
+        self.assertIn(b'api_response_cache_lookups_total{result="hit"}', self.client.get('/metrics').content)
+
+    def test_writes_invalidate(self):
+        writes = [
+            lambda: self.client.post('/app/', {'name': 'New App', 'description': 'meaow'}),
+            lambda: self.client.post('/app/bulk/', [{'name': 'Bulk App', 'description': 'bulk'}], format='json'),
+            lambda: self.client.put('/app/{}/'.format(self.app.id), {'name': 'Updated App'}),
+            lambda: self.client.put('/app/sub/{}/'.format(self.app.id), {'plan': 'PRO'}),
+            lambda: self.client.put('/app/sub/bulk/', {'plan': 'STANDARD', 'apps': 'all'}, format='json'),
+            lambda: self.client.delete('/app/sub/{}/'.format(self.app.id)),
+        ]
+        for write in writes:
+            for url in self.urls:
+                self.client.get(url)
+            version = response_cache.get_version(self.user)
+            write()
+            self.assertGreater(response_cache.get_version(self.user), version)
+            for url in self.urls:
+                self.assertCacheStatus(url, 'MISS')
+        response = self.client.get(self.urls[1])
+        self.assertEqual(response.data['name'], 'Updated App')
+        self.assertEqual(response.data['subscription']['plan']['name'], 'STANDARD')
+        self.assertFalse(response.data['subscription']['active'])
+
+        self.client.delete(self.urls[1])
+        self.assertEqual(len(self.client.get(self.urls[0]).data), 2)
+
+    def test_stale_entries_are_not_served_without_a_version_bump(self):
+        # A write made by another worker does not bump this process's counter.
+        self.client.get(self.urls[1])
+        App.objects.filter(pk=self.app.pk).update(name='Changed Elsewhere', updated_at=timezone.now())
+        response = self.assertCacheStatus(self.urls[1], 'MISS')
+        self.assertEqual(response.data['name'], 'Changed Elsewhere')
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+        },
+        APP_RESPONSE_CACHE={'ALIAS': 'shared', 'TIMEOUT': 60},
+    )
+    def test_django_cache_backend(self):
+        self.assertCacheStatus(self.urls[0], 'MISS')
+        self.assertCacheStatus(self.urls[0], 'HIT')
+        self.client.post('/app/', {'name': 'New App', 'description': 'meaow'})
+        self.assertCacheStatus(self.urls[0], 'MISS')
+
+
+class FastSerializationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        plan = Plan.objects.create(name='PRO')
+        apps = [
+            App.objects.create(user=self.user, name='Plain', description='meaow'),
+            App.objects.create(user=self.user, name='Unicode \u00e9\u4e2d \u2028\u2029', description='line\nbreak\t"quoted"\x01'),
+            App.objects.create(user=self.user, name='No subscription', description=''),
+        ]
+        Subscription.objects.create(app=apps[0], plan=plan)
+        Subscription.objects.create(
+            app=apps[1], plan=plan, active=False,
+            end_date=timezone.now().replace(microsecond=0),
+        )
+
+    def test_fast_path_matches_serializer(self):
+        apps = App.objects.filter(user=self.user).order_by('id')
+        expected = JSONRenderer().render(AppSerializer(apps, many=True).data)
+        actual = FastJSONRenderer().render(serialize_app_rows(app_rows(apps)))
+        self.assertEqual(actual, expected)
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'when': timezone.now(),
+            'text': '\u2028 \u00e9',
+            'nested': [{'a': 1, 'b': None, 'c': True}, 1.5],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+        # Only the spelling of some floats differs.
+        data = {'large': 1e16, 'small': 1e-7}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_app_list_uses_fast_path(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/app/')
+        apps = App.objects.filter(user=self.user)
+        self.assertEqual(response.content, JSONRenderer().render(AppSerializer(apps, many=True).data))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EndpointBenchmarkTestCase(TransactionTestCase):
+    # Budgets are measured outside a wrapping transaction, where atomic() adds no savepoint queries.
+    def setUp(self):
+        use_temporary_path(self, 'SHARED_STATE')
+        plan_catalog.clear()
+        token_cache.clear()
+        response_cache.clear()
+
+    def test_benchmark_covers_every_route_within_budget(self):
+        results = EndpointBenchmark(users=2, apps_per_user=5, requests=3).run()
+        routes = {str(pattern.pattern) for pattern in urls.urlpatterns}
+        self.assertEqual({result['route'] for result in results['endpoints'].values()}, routes)
+        for name, result in results['endpoints'].items():
+            self.assertEqual(result['requests'], 3)
+            self.assertTrue(all(code.startswith('2') for code in result['status_codes']), name)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        self.assertEqual(check_budgets(results, QUERY_BUDGETS), [])
+
+    def test_query_counts_do_not_depend_on_buffered_events(self):
+        benchmark = EndpointBenchmark(users=1, apps_per_user=5, requests=3)
+        only = ['subscription_history', 'subscription_update']
+        benchmark.run(only=only)
+        # A second pass, with the plan catalog and token cache already warm.
+        clean = benchmark.run_scenarios(only=only)['endpoints']
+        # Left behind by earlier scenarios; never written inside a measured request.
+        self.addCleanup(event_buffer.clear)
+        event_buffer.add([make_event(0, SubscriptionEvent.CREATED, 'FREE') for _ in range(400)])
+        buffered = benchmark.run_scenarios(only=only)['endpoints']
+        for name in only:
+            self.assertEqual(buffered[name]['queries'], clean[name]['queries'], name)
+
+    def test_check_budgets_reports_regressions(self):
+        results = EndpointBenchmark(users=1, apps_per_user=2, requests=2).run(only=['app_list'])
+        self.assertEqual(list(results['endpoints']), ['app_list'])
+        failures = check_budgets(results, {'app_list': 0})
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].startswith('app_list:'))
+
+
+class RequestInstrumentationTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        response_cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        App.objects.create(user=self.user, name='Test App', description='meaow')
+
+    def server_timing(self, response):
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timings[name] = dict(param.split('=', 1) for param in params)
+        return timings
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/app/')
+        timings = self.server_timing(response)
+        self.assertEqual(set(timings), {'db', 'serialize', 'total'})
+        self.assertEqual(timings['db']['desc'], '"{} queries"'.format(len(queries)))
+        self.assertGreater(float(timings['serialize']['dur']), 0)
+        self.assertGreaterEqual(float(timings['total']['dur']), float(timings['db']['dur']))
+
+    @override_settings(REQUEST_INSTRUMENTATION={'ENABLED': True, 'SLOW_REQUEST_MS': 0, 'SLOW_QUERIES': 2})
+    def test_slow_request_is_logged_with_slowest_queries(self):
+        with self.assertLogs('api.requests', 'WARNING') as logs:
+            response = self.client.get('/app/?page_size=10')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        fields = logs.records[0].fields
+        self.assertEqual(fields['path'], '/app/?page_size=10')
+        self.assertEqual(fields['status'], 200)
+        self.assertGreaterEqual(fields['queries'], 2)
+        slowest = fields['slowest_queries']
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['ms'], slowest[1]['ms'])
+
+        line = json.loads(JSONFormatter().format(logs.records[0]))
+        self.assertEqual(line['logger'], 'api.requests')
+        self.assertEqual(line['queries'], fields['queries'])
+
+    @override_settings(REQUEST_INSTRUMENTATION={'ENABLED': True, 'SLOW_REQUEST_MS': 60000})
+    def test_fast_request_is_not_logged(self):
+        with mock.patch.object(middleware.logger, 'warning') as warning:
+            self.client.get('/app/')
+        warning.assert_not_called()
+
+    def test_async_queries_are_recorded(self):
+        async def get_response(request):
+            await sync_to_async(list)(App.objects.all())
+            return HttpResponse()
+
+        instrumented = middleware.RequestInstrumentationMiddleware(get_response)
+        response = async_to_sync(instrumented)(AsyncRequestFactory().get('/'))
+        self.assertEqual(self.server_timing(response)['db']['desc'], '"1 queries"')
+
+    @override_settings(REQUEST_INSTRUMENTATION={'ENABLED': False})
+    def test_disabled(self):
+        response = self.client.get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        response_cache.clear()
+        metrics.business_metrics.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def sample(self, name, **labels):
+        return metrics.registry.get_sample_value(name, labels) or 0
+
+    def test_requests_are_labelled_by_view(self):
+        before = self.sample('api_requests_total', view='AppListCreateView', method='GET', status='200')
+        latency_before = self.sample('api_request_duration_seconds_count', view='AppListCreateView', method='GET')
+        self.client.get('/app/')
+        self.client.get('/app/')
+        self.assertEqual(
+            self.sample('api_requests_total', view='AppListCreateView', method='GET', status='200'), before + 2)
+        self.assertEqual(
+            self.sample('api_request_duration_seconds_count', view='AppListCreateView', method='GET'),
+            latency_before + 2)
+
+        before = self.sample('api_requests_total', view='signup', method='POST', status='200')
+        self.client.post('/signup', {'username': 'new', 'password': 'newpassword', 'email': 'new@example.com'})
+        self.assertEqual(self.sample('api_requests_total', view='signup', method='POST', status='200'), before + 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'api_requests_total{method="GET",status="200",view="AppListCreateView"}', response.content)
+
+    def test_business_gauges_are_cached(self):
+        app = App.objects.create(user=self.user, name='Test App', description='meaow')
+        Subscription.objects.create(app=app, plan=Plan.objects.create(name='PRO'))
+        with CaptureQueriesContext(connection) as queries:
+            content = self.client.get('/metrics').content
+        self.assertEqual(len(queries), 2)
+        self.assertIn(b'api_active_subscriptions{plan="PRO"} 1.0', content)
+        self.assertIn(b'api_active_subscriptions{plan="FREE"} 0.0', content)
+        self.assertIn(b'api_apps 1.0', content)
+
+        App.objects.create(user=self.user, name='Second App', description='meaow')
+        with CaptureQueriesContext(connection) as queries:
+            content = self.client.get('/metrics').content
+        self.assertEqual(len(queries), 0)
+        self.assertIn(b'api_apps 1.0', content)
+
+    @override_settings(METRICS={'ENABLED': True, 'TOKEN': 'secret', 'BUSINESS_TTL': 60})
+    def test_token(self):
+        client = APIClient()
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        client.credentials(HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_200_OK)
+
+    def test_multiprocess_aggregation(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        script = "from api.metrics import observe_request; observe_request('login', 'POST', 500, 0.01)"
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=path)
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, check=True)
+
+        aggregated = CollectorRegistry()
+        MultiProcessCollector(aggregated, path=path)
+        labels = {'view': 'login', 'method': 'POST'}
+        self.assertEqual(aggregated.get_sample_value('api_requests_total', dict(labels, status='500')), 2)
+        self.assertEqual(aggregated.get_sample_value('api_request_errors_total', labels), 2)
+        self.assertEqual(aggregated.get_sample_value('api_request_duration_seconds_count', labels), 2)
+
+
+class SubscriptionExpiryTestCase(QueryPlanMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.plan = Plan.objects.create(name='PRO')
+        self.now = timezone.now()
+        self.expired = [self.subscribe(self.now - timezone.timedelta(days=i + 1)) for i in range(5)]
+        self.future = self.subscribe(self.now + timezone.timedelta(days=1))
+        self.open_ended = self.subscribe(None)
+        self.cancelled = self.subscribe(self.now - timezone.timedelta(days=1), active=False)
+
+    def subscribe(self, end_date, active=True):
+        app = App.objects.create(user=self.user, name='Test App')
+        return Subscription.objects.create(app=app, plan=self.plan, end_date=end_date, active=active)
+
+    def active_ids(self):
+        return set(Subscription.objects.filter(active=True).values_list('pk', flat=True))
+
+    def test_expires_in_chunks(self):
+        chunks = []
+        total = expire_subscriptions(self.now, chunk_size=2, on_chunk=lambda count, total: chunks.append(count))
+        self.assertEqual(total, 5)
+        self.assertEqual(chunks, [2, 2, 1])
+        self.assertEqual(self.active_ids(), {self.future.pk, self.open_ended.pk})
+        subscription = Subscription.objects.get(pk=self.expired[0].pk)
+        self.assertEqual(subscription.updated_at, self.now)
+
+    def test_idempotent(self):
+        expire_subscriptions(self.now, chunk_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(expire_subscriptions(self.now, chunk_size=3), 0)
+        self.assertEqual(len(queries), 3)  # savepoint, UPDATE, release
+
+    def test_chunk_uses_expiry_index(self):
+        ids = expired_subscriptions(self.now).order_by('end_date').values('pk')[:1000]
+        self.assertNoFullTableScan(ids)
+        self.assertTrue(any('api_sub_expiry_idx' in detail for detail in self.get_query_plan(ids)))
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('expire_subscriptions', chunk_size=2, stdout=stdout)
+        self.assertIn('Deactivated 5 expired subscriptions', stdout.getvalue())
+        self.assertEqual(self.active_ids(), {self.future.pk, self.open_ended.pk})
+
+
+class RevenueReportTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.admin = User.objects.create_user(username='admin', password='testpassword', is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.admin).key)
+        plans = {name: Plan.objects.create(name=name) for name in ['FREE', 'STANDARD', 'PRO']}
+        self.alice = User.objects.create_user(username='alice', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', password='testpassword')
+        for user, plan, active in [
+            (self.alice, 'PRO', True), (self.alice, 'PRO', True), (self.alice, 'STANDARD', True),
+            (self.alice, 'PRO', False), (self.bob, 'STANDARD', True), (self.bob, 'FREE', True),
+        ]:
+            app = App.objects.create(user=user, name='Test App')
+            Subscription.objects.create(app=app, plan=plans[plan], active=active)
+
+    def test_report(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/reports/revenue/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Token lookup, then one aggregate query per report.
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(response.data['plans'], [
+            {'plan': 'FREE', 'price': 0, 'active_subscriptions': 1, 'mrr': 0},
+            {'plan': 'STANDARD', 'price': 10, 'active_subscriptions': 2, 'mrr': 20},
+            {'plan': 'PRO', 'price': 25, 'active_subscriptions': 2, 'mrr': 50},
+        ])
+        self.assertEqual(response.data['totals'], {'active_subscriptions': 5, 'mrr': 70})
+        self.assertEqual(response.data['top_users'], [
+            {'user_id': self.alice.id, 'username': 'alice', 'active_subscriptions': 3, 'monthly_spend': 60},
+            {'user_id': self.bob.id, 'username': 'bob', 'active_subscriptions': 2, 'monthly_spend': 10},
+        ])
+
+    def test_user_limit(self):
+        response = self.client.get('/reports/revenue/?users=1')
+        self.assertEqual([row['username'] for row in response.data['top_users']], ['alice'])
+        self.assertEqual(self.client.get('/reports/revenue/?users=0').data['top_users'], [])
+        self.assertEqual(self.client.get('/reports/revenue/?users=x').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_admin_only(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.bob).key)
+        self.assertEqual(self.client.get('/reports/revenue/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(APP_EXPORT_CHUNK_SIZE=2)
+class AppExportTestCase(TransactionTestCase):
+    # Not TestCase: under ASGI the export queries run on another thread's connection.
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        plan = Plan.objects.create(name='PRO')
+        for i in range(5):
+            app = App.objects.create(user=self.user, name='App {}'.format(i), description='line\nbreak, "quoted"')
+            if i != 2:
+                Subscription.objects.create(app=app, plan=plan)
+        other = User.objects.create_user(username='other', password='testpassword')
+        App.objects.create(user=other, name='Other App')
+
+    def expected(self):
+        apps = App.objects.filter(user=self.user).order_by('created_at', 'id')
+        return json.loads(JSONRenderer().render(AppSerializer(apps, many=True).data))
+
+    def test_ndjson(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/app/export/')
+            chunks = list(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        # Five apps in chunks of two: three range queries after the token lookup.
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected())
+
+    def test_csv(self):
+        response = self.client.get('/app/export/?format=csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="apps.csv"')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        expected = self.expected()
+        self.assertEqual([int(row['id']) for row in rows], [app['id'] for app in expected])
+        self.assertEqual(rows[0]['description'], 'line\nbreak, "quoted"')
+        self.assertEqual(rows[0]['plan'], 'PRO')
+        self.assertEqual(rows[0]['price'], '25')
+        self.assertEqual(rows[2]['plan'], '')
+
+    def test_unknown_format(self):
+        response = self.client.get('/app/export/?format=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_asgi(self):
+        async def export():
+            # Iterating here, on the event loop, fails if the export touches the ORM.
+            response = await AsyncClient().get('/app/export/', authorization='Token ' + self.token.key)
+            return response, b''.join(response.streaming_content)
+
+        response, content = async_to_sync(export)()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([json.loads(line) for line in content.decode().splitlines()], self.expected())
+
+
+class SubscriptionHistoryTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        token_cache.clear()
+        event_buffer.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        for name in ['FREE', 'STANDARD', 'PRO']:
+            Plan.objects.create(name=name)
+
+    def change(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300)
+        return response
+
+    def history(self, app_id, url=None):
+        response = self.client.get(url or '/app/{}/history/'.format(app_id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_every_change_is_recorded(self):
+        app_id = self.change('post', '/app/', {'name': 'Test App', 'description': 'meaow'}).data['id']
+        self.change('put', '/app/sub/{}/'.format(app_id), {'plan': 'PRO'})
+        self.change('put', '/app/sub/{}/'.format(app_id), {'plan': 'PRO'})
+        self.change('delete', '/app/sub/{}/'.format(app_id))
+        self.change('delete', '/app/sub/{}/'.format(app_id))
+        self.change('put', '/app/sub/{}/'.format(app_id), {'plan': 'PRO'})
+
+        # Buffered, not written yet, and not flushed by reading the history.
+        self.assertEqual(SubscriptionEvent.objects.count(), 0)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.history(app_id)['results'], [])
+        self.assertEqual(len(event_buffer), 4)
+        event_buffer.flush()
+        events = self.history(app_id)['results']
+        self.assertEqual(
+            [(event['kind'], event['plan'], event['previous_plan']) for event in events],
+            [('created', 'FREE', None), ('plan_changed', 'PRO', 'FREE'),
+             ('deactivated', 'PRO', None), ('reactivated', 'PRO', None)],
+        )
+
+    def test_failed_change_is_not_recorded(self):
+        app_id = self.change('post', '/app/', {'name': 'Test App', 'description': 'meaow'}).data['id']
+        event_buffer.flush()
+        for method, data in [('put', {'plan': 'PRO'}), ('delete', None)]:
+            # Outside a transaction, as without an Idempotency-Key, on_commit callbacks run at once.
+            with self.captureOnCommitCallbacks(execute=True), \
+                    mock.patch.object(Subscription, 'save', side_effect=DatabaseError('disk full')):
+                with self.assertRaises(DatabaseError):
+                    getattr(self.client, method)('/app/sub/{}/'.format(app_id), data, format='json')
+        self.assertEqual(len(event_buffer), 0)
+        self.assertEqual([event['kind'] for event in self.history(app_id)['results']], ['created'])
+
+    def test_async_app_delete_is_recorded(self):
+        app_id = self.change('post', '/app/', {'name': 'Test App', 'description': 'meaow'}).data['id']
+        self.change('put', '/app/sub/{}/'.format(app_id), {'plan': 'PRO'})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/app/{}/'.format(app_id), HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        event_buffer.flush()
+        self.assertEqual(
+            list(SubscriptionEvent.objects.filter(app_id=app_id).order_by('id').values_list('kind', 'plan')),
+            [('created', 'FREE'), ('plan_changed', 'PRO'), ('deactivated', 'PRO')],
+        )
+
+    def test_bulk_changes_are_recorded(self):
+        apps = self.change('post', '/app/bulk/', [{'name': 'App {}'.format(i), 'description': 'meaow'} for i in range(3)]).data
+        app_ids = [app['id'] for app in apps]
+        Subscription.objects.filter(app_id=app_ids[2]).delete()
+        self.change('put', '/app/sub/bulk/', {'plan': 'FREE', 'apps': 'all'})
+        self.change('put', '/app/sub/bulk/', {'plan': 'PRO', 'apps': app_ids[:2]})
+        event_buffer.flush()
+        kinds = {
+            app_id: list(SubscriptionEvent.objects.filter(app_id=app_id).order_by('id').values_list('kind', flat=True))
+            for app_id in app_ids
+        }
+        self.assertEqual(kinds[app_ids[0]], ['created', 'plan_changed'])
+        self.assertEqual(kinds[app_ids[1]], ['created', 'plan_changed'])
+        # Recreated by the first bulk update, untouched by the second.
+        self.assertEqual(kinds[app_ids[2]], ['created', 'created'])
+
+    def test_expiry_is_recorded(self):
+        app = App.objects.create(user=self.user, name='Test App')
+        Subscription.objects.create(
+            app=app, plan=plan_catalog.get('PRO'), end_date=timezone.now() - timezone.timedelta(days=1),
+        )
+        expire_subscriptions(timezone.now())
+        self.assertEqual(
+            list(SubscriptionEvent.objects.values_list('app_id', 'kind', 'plan')),
+            [(app.id, 'deactivated', 'PRO')],
+        )
+
+    @override_settings(SUBSCRIPTION_EVENTS={'BUFFER_SIZE': 3, 'FLUSH_INTERVAL': None})
+    def test_flushes_when_full(self):
+        self.change('post', '/app/bulk/', [{'name': 'App {}'.format(i), 'description': 'meaow'} for i in range(2)])
+        self.assertEqual(SubscriptionEvent.objects.count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.change('post', '/app/', {'name': 'Third', 'description': 'meaow'})
+        self.assertEqual(SubscriptionEvent.objects.count(), 3)
+        self.assertEqual(len([query for query in queries if 'INSERT INTO "api_subscriptionevent"' in query['sql']]), 1)
+        self.assertEqual(len(event_buffer), 0)
+
+    def test_stop_flushes(self):
+        app = App.objects.create(user=self.user, name='Test App')
+        event_buffer.add([make_event(app.id, SubscriptionEvent.CREATED, 'FREE')])
+        event_buffer.stop()
+        self.assertEqual(SubscriptionEvent.objects.count(), 1)
+
+    def test_pagination(self):
+        app = App.objects.create(user=self.user, name='Test App')
+        event_buffer.add([make_event(app.id, SubscriptionEvent.CREATED, 'FREE') for _ in range(3)])
+        event_buffer.flush()
+        page = self.history(app.id, '/app/{}/history/?page_size=2'.format(app.id))
+        self.assertEqual(len(page['results']), 2)
+        rest = self.history(app.id, page['next'])
+        self.assertEqual(len(rest['results']), 1)
+        self.assertIsNone(rest['next'])
+
+    def test_other_users_app(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        app = App.objects.create(user=other, name='Other App')
+        response = self.client.get('/app/{}/history/'.format(app.id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LoginThrottleTestCase(TestCase):
+    def setUp(self):
+        self.options = use_temporary_path(
+            self, 'LOGIN_THROTTLE', ENABLED=True, IP_RATE='100/min', USERNAME_RATE='2/min', SLOTS=64,
+        )
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = APIClient()
+
+    def login(self, username='testuser', password='wrongpassword', **extra):
+        return self.client.post('/login', {'username': username, 'password': password}, **extra)
+
+    def test_username_limit_runs_before_hashing_and_queries(self):
+        self.assertEqual(self.login().status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.login(username='TESTUSER').status_code, status.HTTP_404_NOT_FOUND)
+        with mock.patch.object(User, 'check_password') as check_password:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.login(password='testpassword')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(len(queries), 0)
+        check_password.assert_not_called()
+        # Other users are not affected.
+        self.assertEqual(self.login(username='someoneelse').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_ip_limit(self):
+        self.options['IP_RATE'] = '3/min'
+        for i in range(3):
+            self.assertEqual(self.login(username='user{}'.format(i)).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.login(username='user3').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.login(username='user3', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        self.options['IP_RATE'] = '1/min'
+        self.login(username='user1', HTTP_X_FORWARDED_FOR='10.0.0.1')
+        response = self.login(username='user2', HTTP_X_FORWARDED_FOR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_async_login(self):
+        factory = AsyncRequestFactory()
+        for expected in [status.HTTP_404_NOT_FOUND, status.HTTP_404_NOT_FOUND, status.HTTP_429_TOO_MANY_REQUESTS]:
+            request = factory.post('/login', {'username': 'testuser', 'password': 'wrongpassword'},
+                                   content_type='application/json')
+            response = async_to_sync(async_views.login)(request)
+            self.assertEqual(response.status_code, expected)
+
+    def test_refill(self):
+        buckets = SharedTokenBuckets(self.options['PATH'], 64)
+        self.assertEqual(buckets.consume('key', 1, 1000), 0)
+        self.assertGreater(buckets.consume('key', 1, 1000), 0)
+        time.sleep(0.01)
+        self.assertEqual(buckets.consume('key', 1, 1000), 0)
+
+    def test_clock_reset(self):
+        # CLOCK_MONOTONIC restarts at boot, but the bucket file can outlive a reboot.
+        buckets = SharedTokenBuckets(self.options['PATH'], 64)
+        self.assertEqual(buckets.consume('key', 1, 1000), 0)
+        with mock.patch('api.throttling.time.monotonic', return_value=time.monotonic() - 10 ** 6):
+            self.assertLessEqual(buckets.consume('key', 1, 1000), 1 / 1000)
+        time.sleep(0.01)
+        self.assertEqual(buckets.consume('key', 1, 1000), 0)
+
+    def test_shared_between_processes(self):
+        script = (
+            'import sys; from api.throttling import SharedTokenBuckets; '
+            'buckets = SharedTokenBuckets(sys.argv[1], 64); '
+            '[buckets.consume("key", 3, 0.001) for _ in range(2)]'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='backend_app.settings')
+        subprocess.run([sys.executable, '-c', script, self.options['PATH']], cwd=settings.BASE_DIR, env=env, check=True)
+        buckets = SharedTokenBuckets(self.options['PATH'], 64)
+        self.assertEqual(buckets.consume('key', 3, 0.001), 0)
+        self.assertGreater(buckets.consume('key', 3, 0.001), 0)
+
+
+class StartupTestCase(TestCase):
+    def test_warm_up_loads_plans_and_closes_connections(self):
+        Plan.objects.create(name='FREE')
+        plan_catalog.clear()
+        with mock.patch.object(connections, 'close_all') as close_all:
+            warm_up()
+        close_all.assert_called_once_with()
+        with self.assertNumQueries(0):
+            self.assertEqual(plan_catalog.get('FREE').name, 'FREE')
+
+    def test_api_settings_profile(self):
+        script = (
+            'import django; django.setup()\n'
+            'from django.core.management import call_command\n'
+            'from django.urls import Resolver404, resolve\n'
+            'call_command("check", fail_level="WARNING")\n'
+            'resolve("/app/")\n'
+            'try:\n'
+            '    resolve("/admin/")\n'
+            'except Resolver404:\n'
+            '    pass\n'
+            'else:\n'
+            '    raise SystemExit("admin is routed")\n'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='backend_app.settings_api')
+        process = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True)
+        self.assertEqual(process.returncode, 0, process.stderr.decode())
+
+    @override_settings(SUBSCRIPTION_EVENTS={'BUFFER_SIZE': 500, 'FLUSH_INTERVAL': 60})
+    def test_forked_worker_restarts_flusher_without_parent_events(self):
+        buffer = EventBuffer()
+        buffer.start()
+        self.addCleanup(buffer.stop)
+        self.addCleanup(buffer.clear)
+        buffer.add([make_event(1, SubscriptionEvent.CREATED, 'FREE')])
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os._exit(0 if len(buffer) == 0 and buffer._thread.is_alive() else 1)
+            finally:
+                os._exit(2)
+        _, code = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(code), 0)
+        self.assertEqual(len(buffer), 1)
+
+
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        token_cache.clear()
+        response_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        for name in ['FREE', 'STANDARD', 'PRO']:
+            Plan.objects.create(name=name)
+        self.app_ids = [
+            self.client.post('/app/', {'name': 'App {}'.format(i), 'description': 'meaow'}, format='json').data['id']
+            for i in range(3)
+        ]
+        self.client.put('/app/sub/{}/'.format(self.app_ids[0]), {'plan': 'PRO'}, format='json')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The query that reads the apps themselves comes after the ETag lookup.
+        return response.data, [q['sql'] for q in queries if 'FROM "api_app"' in q['sql']][-1]
+
+    def test_fields_select_only_requested_columns(self):
+        data, sql = self.get('/app/?fields=name,id')
+        self.assertEqual(data, [{'id': pk, 'name': 'App {}'.format(i)} for i, pk in enumerate(self.app_ids)])
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('description', sql)
+
+    def test_expand_subscription(self):
+        full = self.client.get('/app/').data
+        data, sql = self.get('/app/?fields=id&expand=subscription')
+        self.assertEqual(data, [{'id': item['id'], 'subscription': item['subscription']} for item in full])
+        self.assertEqual(data[0]['subscription']['plan']['name'], 'PRO')
+        self.assertIn('JOIN', sql)
+        self.assertNotIn('description', sql)
+
+    def test_full_representation_by_default(self):
+        expected = AppSerializer(App.objects.filter(user=self.user).order_by('created_at', 'id'), many=True).data
+        self.assertEqual(self.client.get('/app/').data, expected)
+        self.assertEqual(self.client.get('/app/?expand=subscription').data, expected)
+        self.assertEqual(self.client.get('/app/{}/'.format(self.app_ids[0])).data, expected[0])
+
+    def test_paginated(self):
+        response = self.client.get('/app/?fields=name&page_size=2')
+        self.assertEqual(response.data['results'], [{'name': 'App 0'}, {'name': 'App 1'}])
+        self.assertIn('fields=name', response.data['next'])
+        self.assertEqual(self.client.get(response.data['next']).data['results'], [{'name': 'App 2'}])
+
+    def test_detail(self):
+        pk = self.app_ids[0]
+        full = self.client.get('/app/{}/'.format(pk)).data
+        data, sql = self.get('/app/{}/?fields=name,updated_at'.format(pk))
+        self.assertEqual(data, {'name': 'App 0', 'updated_at': full['updated_at']})
+        self.assertNotIn('JOIN', sql)
+        data, _ = self.get('/app/{}/?fields=name&expand=subscription'.format(pk))
+        self.assertEqual(data, {'name': 'App 0', 'subscription': full['subscription']})
+
+        other = APIClient()
+        other_user = User.objects.create_user(username='other', password='testpassword')
+        other.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other_user).key)
+        self.assertEqual(other.get('/app/{}/?fields=name'.format(pk)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cached_per_fieldset(self):
+        url = '/app/{}/'.format(self.app_ids[1])
+        self.assertEqual(self.client.get(url).data['name'], 'App 1')
+        response = self.client.get(url + '?fields=id')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data, {'id': self.app_ids[1]})
+        self.assertEqual(self.client.get(url + '?fields=id')['X-Cache'], 'HIT')
+
+    def test_invalid(self):
+        for query in ['fields=password', 'fields=', 'fields=id&expand=user', 'fields=subscription']:
+            response = self.client.get('/app/?' + query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        response = self.client.get('/app/{}/?fields=user'.format(self.app_ids[0]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        plan_catalog.clear()
+        token_cache.clear()
+        event_buffer.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        for name in ['FREE', 'STANDARD', 'PRO']:
+            Plan.objects.create(name=name)
+
+    def create(self, key='key-1', client=None, **data):
+        data = dict({'name': 'Test App', 'description': 'meaow'}, **data)
+        return (client or self.client).post('/app/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_stored_response_without_writing(self):
+        first = self.create()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', first)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.create()
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(App.objects.count(), 1)
+        self.assertFalse([q for q in queries if 'api_app' in q['sql'] or 'api_subscription' in q['sql']])
+
+    def test_subscription_change_replay(self):
+        app_id = self.create(key='create').data['id']
+        url = '/app/sub/{}/'.format(app_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.put(url, {'plan': 'PRO'}, format='json', HTTP_IDEMPOTENCY_KEY='upgrade')
+        self.assertEqual(first.data['plan']['name'], 'PRO')
+        self.client.put(url, {'plan': 'STANDARD'}, format='json')
+        events = len(event_buffer)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.client.put(url, {'plan': 'PRO'}, format='json', HTTP_IDEMPOTENCY_KEY='upgrade')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Subscription.objects.get(app_id=app_id).plan.name, 'STANDARD')
+        self.assertEqual(len(event_buffer), events)
+
+    def test_key_reused_with_different_request(self):
+        self.create()
+        response = self.create(name='Other App')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(App.objects.count(), 1)
+
+    def test_keys_are_per_user_and_optional(self):
+        other = APIClient()
+        other_user = User.objects.create_user(username='other', password='testpassword')
+        other.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other_user).key)
+        self.create()
+        self.assertEqual(self.create(client=other).status_code, status.HTTP_201_CREATED)
+        self.client.post('/app/', {'name': 'Test App', 'description': 'meaow'}, format='json')
+        self.client.post('/app/', {'name': 'Test App', 'description': 'meaow'}, format='json')
+        self.assertEqual(App.objects.count(), 4)
+
+    def test_client_errors_are_stored(self):
+        self.assertEqual(self.create(description='').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.create(description='')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_invalid_key(self):
+        self.assertEqual(self.create(key='k' * 256).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(App.objects.count(), 0)
+
+    def test_duplicate_waits_for_request_in_progress(self):
+        first = self.create()
+        record = IdempotencyKey.objects.get(key='key-1')
+        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=None, response='')
+
+        def finish(delay):
+            # The first request completes while the duplicate is polling.
+            IdempotencyKey.objects.filter(pk=record.pk).update(status_code=record.status_code, response=record.response)
+
+        with mock.patch('api.idempotency.time.sleep', side_effect=finish) as sleep:
+            response = self.create()
+        sleep.assert_called_once()
+        self.assertEqual(response.json(), first.json())
+        self.assertEqual(App.objects.count(), 1)
+
+    def test_duplicate_gives_up_after_wait_timeout(self):
+        self.create()
+        IdempotencyKey.objects.update(status_code=None, response='')
+        with self.settings(IDEMPOTENCY=dict(settings.IDEMPOTENCY, WAIT_TIMEOUT=0)):
+            response = self.create()
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(App.objects.count(), 1)
+
+    def test_abandoned_and_expired_keys_are_taken_over(self):
+        self.create()
+        IdempotencyKey.objects.update(status_code=None, response='', expires_at=timezone.now())
+        self.assertNotIn('Idempotent-Replayed', self.create())
+        self.assertEqual(App.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertNotIn('Idempotent-Replayed', self.create())
+        self.assertEqual(App.objects.count(), 3)
+
+    def test_failed_request_is_rolled_back_and_releases_key(self):
+        with mock.patch.object(views.plan_catalog, 'get', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create()
+        self.assertEqual(App.objects.count(), 0)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create().status_code, status.HTTP_201_CREATED)
+
+    def test_purge_expired(self):
+        self.create(key='old')
+        self.create(key='new')
+        IdempotencyKey.objects.filter(key='old').update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--chunk-size', '1', stdout=out)
+        self.assertIn('Deleted 1 ', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class DeletionTestCase(TestCase):
+    def setUp(self):
+        use_temporary_path(self, 'SHARED_STATE')
+        use_temporary_path(self, 'LOGIN_THROTTLE')
+        plan_catalog.clear()
+        token_cache.clear()
+        response_cache.clear()
+        get_buckets().clear()
+        event_buffer.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        for name in ['FREE', 'STANDARD', 'PRO']:
+            Plan.objects.create(name=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app_ids = [
+                self.client.post('/app/', {'name': 'App {}'.format(i), 'description': 'meaow'}, format='json').data['id']
+                for i in range(5)
+            ]
+        event_buffer.flush()
+
+    def purge(self, *args):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_deleted', '--chunk-size', '2', *args, stdout=out)
+        # Set-based deletes: no app rows are loaded into memory.
+        self.assertFalse([q for q in queries if '"api_app"."description"' in q['sql']])
+        return out.getvalue()
+
+    def test_async_delete(self):
+        pk = self.app_ids[0]
+        response = self.client.delete('/app/{}/'.format(pk), HTTP_PREFER='respond-async, wait=10')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        self.assertEqual(self.client.get('/app/{}/'.format(pk)).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn(pk, [app['id'] for app in self.client.get('/app/').data])
+        self.assertTrue(App.all_objects.filter(pk=pk).exists())
+        self.assertFalse(Subscription.objects.get(app_id=pk).active)
+
+        output = self.purge()
+        self.assertIn('Purged 1 deleted apps', output)
+        self.assertFalse(App.all_objects.filter(pk=pk).exists())
+        self.assertFalse(Subscription.objects.filter(app_id=pk).exists())
+        # History is kept, as for a direct delete.
+        self.assertTrue(SubscriptionEvent.objects.filter(app_id=pk).exists())
+        self.assertEqual(App.objects.count(), 4)
+
+    def test_delete_without_preference(self):
+        pk = self.app_ids[0]
+        response = self.client.delete('/app/{}/'.format(pk), HTTP_PREFER='handling=lenient')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(App.all_objects.filter(pk=pk).exists())
+
+    def test_account_deletion(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        bulk_create_apps(other, [{'name': 'Other', 'description': 'meaow'}])
+        self.client.post('/app/', {'name': 'App', 'description': 'meaow'}, format='json', HTTP_IDEMPOTENCY_KEY='k')
+
+        output = self.purge('--account', 'testuser')
+        self.assertIn('Marked account testuser deleted', output)
+        self.assertIn('and 1 accounts', output)
+        self.assertFalse(User.objects.filter(username='testuser').exists())
+        self.assertFalse(App.all_objects.filter(user_id=self.user.pk).exists())
+        self.assertFalse(Subscription.objects.filter(app_id__in=self.app_ids).exists())
+        self.assertFalse(SubscriptionEvent.objects.filter(app_id__in=self.app_ids).exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertIsNotNone(AccountDeletion.objects.get(user_id=self.user.pk).completed_at)
+        self.assertEqual(App.objects.filter(user=other).count(), 1)
+
+    def test_marked_account_cannot_authenticate(self):
+        mark_account_deleted(self.user)
+        self.assertEqual(self.client.get('/app/').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = APIClient().post('/login', {'username': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # Data stays until purged.
+        self.assertEqual(App.objects.filter(user=self.user).count(), 5)
+
+    def test_chunks(self):
+        for pk in self.app_ids:
+            self.client.delete('/app/{}/'.format(pk), HTTP_PREFER='respond-async')
+        chunks = []
+        apps, rows, accounts = purge_deleted(chunk_size=2, on_chunk=lambda count, seconds: chunks.append(count))
+        self.assertEqual((apps, rows, accounts), (5, 0, 0))
+        self.assertEqual(chunks, [2, 2, 1, 0])
+
+
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """A second SQLite file stands in for the replica, synced with sync_replica."""
+    alias = 'replica_test'
+
+    def setUp(self):
+        plan_catalog.clear()
+        token_cache.clear()
+        response_cache.clear()
+        replica_lag.clear()
+        use_temporary_path(self, 'SHARED_STATE')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.settings[self.alias] = dict(
+            connections['default'].settings_dict, NAME=os.path.join(directory, 'replica.sqlite3'),
+        )
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(connections.__delitem__, self.alias)
+        self.addCleanup(connections[self.alias].close)
+        replicas = override_settings(DATABASE_REPLICAS=[self.alias])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+        self.addCleanup(replica_lag.clear)
+
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        App.objects.create(user=self.user, name='Synced')
+
+    def sync(self):
+        call_command('sync_replica', stdout=StringIO())
+        replica_lag.clear()
+
+    def app_names(self, client=None):
+        response = (client or self.client).get('/app/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(app['name'] for app in response.data)
+
+    def test_reads_use_replica_until_synced(self):
+        self.sync()
+        App.objects.create(user=self.user, name='Unsynced')
+        response = self.client.get('/app/')
+        self.assertEqual([app['name'] for app in response.data], ['Synced'])
+        self.assertRegex(response['Server-Timing'], r'replica;dur=[0-9.]+;desc="replica_test lag"')
+
+        self.sync()
+        self.assertEqual(self.app_names(), ['Synced', 'Unsynced'])
+        self.assertIsNotNone(metrics.registry.get_sample_value('api_replica_lag_seconds', {'replica': self.alias}))
+
+    def test_client_reads_its_own_writes(self):
+        self.sync()
+        response = self.client.post('/app/', {'name': 'Written', 'description': 'meaow'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ReplicaHeartbeat.objects.using(self.alias).count(), 1)
+        self.assertFalse(App.objects.using(self.alias).filter(name='Written').exists())
+        # The replica is within MAX_LAG but older than the write: the client stays on the primary,
+        # however long the next sync takes.
+        self.assertLess(replica_lag.get(self.alias), settings.READ_REPLICAS['MAX_LAG'])
+        for _ in range(2):
+            response = self.client.get('/app/')
+            self.assertNotIn('replica;', response['Server-Timing'])
+            self.assertEqual(sorted(app['name'] for app in response.data), ['Synced', 'Written'])
+
+        # Other clients still read from the replica.
+        other = User.objects.create_user(username='other', password='testpassword')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other).key)
+        self.assertIn('replica;', client.get('/app/')['Server-Timing'])
+
+        self.sync()
+        response = self.client.get('/app/')
+        self.assertIn('replica;', response['Server-Timing'])
+        self.assertEqual(sorted(app['name'] for app in response.data), ['Synced', 'Written'])
+
+    def test_request_reads_one_replica(self):
+        other = 'replica_other'
+        connections.settings[other] = dict(
+            connections[self.alias].settings_dict, NAME=connections[self.alias].settings_dict['NAME'] + '-other',
+        )
+        self.addCleanup(connections.settings.pop, other)
+        self.addCleanup(connections.__delitem__, other)
+        self.addCleanup(connections[other].close)
+        replicas = override_settings(DATABASE_REPLICAS=[self.alias, other])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+        self.sync()
+        App.objects.create(user=self.user, name='Later')
+        call_command('sync_replica', replica=[self.alias], stdout=StringIO())
+        replica_lag.clear()
+
+        # The two replicas are at different sync points.
+        expected = {}
+        for alias in (self.alias, other):
+            token = read_replica.set(alias)
+            expected[app_list_etag(self.user)] = sorted(App.objects.filter(user=self.user).values_list('name', flat=True))
+            read_replica.reset(token)
+        self.assertEqual(sorted(expected.values()), [['Later', 'Synced'], ['Synced']])
+        for _ in range(20):
+            response_cache.clear()
+            response = self.client.get('/app/')
+            self.assertEqual(sorted(app['name'] for app in response.data), expected[response['ETag']])
+
+    def test_authentication_reads_primary(self):
+        self.sync()
+        user = User.objects.create_user(username='newuser', password='testpassword')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        self.assertEqual(self.app_names(client), [])
+
+    def test_lagging_or_unsynced_replica_is_skipped(self):
+        App.objects.create(user=self.user, name='Unsynced')
+        self.assertEqual(self.app_names(), ['Synced', 'Unsynced'])
+
+        self.sync()
+        App.objects.create(user=self.user, name='Later')
+        ReplicaHeartbeat.objects.using(self.alias).update(
+            beat_at=timezone.now() - timezone.timedelta(seconds=settings.READ_REPLICAS['MAX_LAG'] + 1),
+        )
+        replica_lag.clear()
+        self.assertEqual(self.app_names(), ['Later', 'Synced', 'Unsynced'])
+
+    def test_router(self):
+        self.sync()
+        self.assertEqual(router.db_for_read(App), 'default')
+        self.assertEqual(choose_replica(), self.alias)
+        # A client that wrote after the replica's last heartbeat.
+        self.assertIsNone(choose_replica(time.time() + 1))
+        token = read_replica.set(self.alias)
+        self.addCleanup(read_replica.reset, token)
+        self.assertEqual(router.db_for_read(App), self.alias)
+        self.assertEqual(router.db_for_write(App), 'default')
+        self.assertEqual(router.db_for_read(Token), 'default')
+        app = App.objects.get()
+        self.assertEqual(app._state.db, self.alias)
+        app.name = 'Renamed'
+        app.save()
+        self.assertEqual(App.objects.using('default').get().name, 'Renamed')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(App), 'default')
+        self.assertFalse(router.allow_migrate(self.alias, 'api'))
+
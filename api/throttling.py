@@ -0,0 +1,103 @@
+"""
+Login throttling with token buckets shared by every worker process.
+
+Buckets live in a memory-mapped file (LOGIN_THROTTLE['PATH']) that all
+gunicorn workers on the host map (an api.shared.SharedTable), so a flood
+spread over several workers is still counted once. The file is a fixed
+open-addressed table of SLOTS buckets; when a probe sequence is full the
+least recently used bucket in it is reused.
+"""
+import fcntl
+import struct
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from . import shared
+
+SLOT = struct.Struct('<Qdd')  # key hash, tokens, last update
+PROBES = 8
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'10/min' -> (capacity 10, refill 10 / 60 tokens per second)."""
+    num, period = rate.split('/')
+    num = int(num)
+    return num, num / DURATIONS[period[0]]
+
+
+def key_hash(key):
+    # Zero marks an empty slot.
+    return shared.key_hash(key) or 1
+
+
+class SharedTokenBuckets(shared.SharedTable):
+    slot = SLOT
+
+    def consume(self, key, capacity, rate):
+        """
+        Take a token from ``key``'s bucket. Returns 0 if one was available,
+        otherwise the number of seconds until the next token.
+        """
+        h = key_hash(key)
+        start = h % self.slots
+        # CLOCK_MONOTONIC is system-wide, so timestamps compare across workers.
+        now = time.monotonic()
+        with self.locked(fcntl.LOCK_EX):
+            offset, tokens, updated = self._find(h, start, capacity, now)
+            # Never negative: the file can outlive a reboot, which restarts CLOCK_MONOTONIC.
+            tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+            if tokens >= 1:
+                SLOT.pack_into(self._map, offset, h, tokens - 1, now)
+                return 0
+            SLOT.pack_into(self._map, offset, h, tokens, now)
+            return (1 - tokens) / rate
+
+    def _find(self, h, start, capacity, now):
+        oldest = None
+        for i in range(PROBES):
+            offset = (start + i) % self.slots * SLOT.size
+            slot_hash, tokens, updated = SLOT.unpack_from(self._map, offset)
+            if slot_hash == h:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                return offset, capacity, now
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0], capacity, now
+
+
+def get_buckets():
+    options = settings.LOGIN_THROTTLE
+    return shared.get_table(SharedTokenBuckets, options['PATH'], options['SLOTS'])
+
+
+def check_login(ident, username):
+    """
+    Consume a login attempt for the client address and the username. Returns
+    0 when the attempt may go ahead, otherwise seconds to wait. Runs before
+    any database lookup or password hashing.
+    """
+    options = settings.LOGIN_THROTTLE
+    if not options['ENABLED']:
+        return 0
+    buckets = get_buckets()
+    wait = buckets.consume('ip:' + ident, *parse_rate(options['IP_RATE']))
+    if wait:
+        return wait
+    if username:
+        return buckets.consume('user:' + str(username).lower(), *parse_rate(options['USERNAME_RATE']))
+    return 0
+
+
+class LoginRateThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        data = request.data
+        username = data.get('username') if hasattr(data, 'get') else None
+        self.retry_after = check_login(self.get_ident(request), username)
+        return not self.retry_after
+
+    def wait(self):
+        return self.retry_after
@@ -1,12 +1,22 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, metrics, views
+
+# The async views only pay off when served through backend_app.asgi.
+auth_views = async_views if settings.ASYNC_AUTH_VIEWS else views
 
 urlpatterns = [
-    path('signup', views.signup),
-    path('login', views.login),
+    path('signup', auth_views.signup),
+    path('login', auth_views.login),
     path('logout', views.logout),
-    path('change_pass', views.change_password),
+    path('change_pass', auth_views.change_password),
     path('app/', views.AppListCreateView.as_view()),
+    path('app/bulk/', views.AppBulkCreateView.as_view()),
+    path('app/export/', views.AppExportView.as_view()),
     path('app/<int:pk>/', views.AppDetailView.as_view()),
-    path('app/sub/<int:pk>/', views.SubscriptionUpdateView.as_view())
+    path('app/sub/<int:pk>/', views.SubscriptionUpdateView.as_view()),
+    path('app/<int:pk>/history/', views.SubscriptionHistoryView.as_view()),
+    path('app/sub/bulk/', views.SubscriptionBulkUpdateView.as_view()),
+    path('reports/revenue/', views.RevenueReportView.as_view()),
+    path('metrics', metrics.metrics_view),
 ]
\ No newline at end of file
@@ -1,34 +1,57 @@
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from django.conf import settings
+from django.db import transaction
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, AppSerializer, SubscriptionSerializer
-from .models import App, Plan, Subscription
+from .serializers import (
+    UserSerializer, AppSerializer, PlanSerializer, SubscriptionEventSerializer, SubscriptionSerializer,
+    AppFieldset, app_row_position, app_rows, serialize_app_rows,
+)
+from .models import App, Plan, Subscription, SubscriptionEvent
+from .accounts import create_user
+from .authentication import CachedTokenAuthentication, token_cache
+from .bulk import bulk_change_plan, bulk_create_apps
+from .cache import response_cache
+from .deletion import mark_app_deleted, prefers_async
+from .history import make_event, record_events
+from .idempotency import idempotent
+from .export import ENCODERS, app_chunks, prefetch_in_thread
+from .conditional import app_detail_etag, app_list_etag, not_modified, set_etag
+from .pagination import KeysetPagination
+from .plans import plan_catalog
+from .throttling import LoginRateThrottle
+from .reports import plan_report, user_spend_report
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.shortcuts import get_object_or_404, Http404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 
 @api_view(['POST'])
 def signup(request):
     serializer = UserSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
-        user = User.objects.get(username=request.data['username'])
-        user.set_password(request.data['password'])
-        user.save()
-        token = Token.objects.create(user=user)
+        # Hash before inserting so the user row is written once, with its token.
+        password = make_password(serializer.validated_data['password'])
+        user, token = create_user(serializer, password)
         return Response({'token': token.key, 'user': serializer.data})
     return Response(serializer.errors, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
+# No authentication: Basic auth would hash a password before the throttle runs.
+@authentication_classes([])
+@throttle_classes([LoginRateThrottle])
 def login(request):
     if 'username' not in request.data:
         return Response({"error": "Username is required"}, status=status.HTTP_400_BAD_REQUEST)
     if 'password' not in request.data:
         return Response({"error": "Password is required"}, status=status.HTTP_400_BAD_REQUEST)
-    user = get_object_or_404(User, username=request.data['username'])
+    # Accounts marked for deletion are inactive and cannot log in.
+    user = get_object_or_404(User, username=request.data['username'], is_active=True)
     if not user.check_password(request.data['password']):
         return Response("error: username or password is wrong", status=status.HTTP_404_NOT_FOUND)
     token, created = Token.objects.get_or_create(user=user)
@@ -36,18 +59,20 @@ def login(request):
     return Response({'token': token.key, 'user': serializer.data})
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication, SessionAuthentication])
+@authentication_classes([CachedTokenAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def logout(request):
     try:
         # Delete the user's token
+        key = request.auth.key
         request.auth.delete()
+        token_cache.evict(key)
         return Response({"message": "Successfully logged out."}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication, SessionAuthentication])
+@authentication_classes([CachedTokenAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def change_password(request):
     user = request.user
@@ -63,11 +88,12 @@ def change_password(request):
         return Response({"error": "Old password is incorrect"}, status=status.HTTP_400_BAD_REQUEST)
     
     user.set_password(new_password)
-    user.save()
-    
-    # Invalidate old token and create a new one
-    Token.objects.filter(user=user).delete()
-    new_token = Token.objects.create(user=user)
+    # Invalidate old token and create a new one; the revocation is stamped on commit.
+    with transaction.atomic():
+        user.save()
+        token_cache.evict_user(user)
+        Token.objects.filter(user=user).delete()
+        new_token = Token.objects.create(user=user)
     
     return Response({
         "message": "Password successfully changed",
@@ -75,67 +101,156 @@ def change_password(request):
     }, status=status.HTTP_200_OK)
 
 class AppListCreateView(APIView):
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
     
 
+    def get_queryset(self, user):
+        # Subscription and plan come from the same joined query as the apps.
+        return App.objects.filter(user=user).select_related('subscription__plan')
+
     def get(self, request):
-        apps = App.objects.filter(user=request.user)
-        serializer = AppSerializer(apps, many=True)
-        return Response(serializer.data)
+        etag = app_list_etag(request.user)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        data, hit = response_cache.get_or_build(request, etag, lambda: self.list_data(request))
+        response = Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return set_etag(response, etag)
 
+    def list_data(self, request):
+        # Read-only listing: project the columns instead of running AppSerializer per app.
+        fieldset = AppFieldset.from_query_params(request.query_params)
+        rows = app_rows(self.get_queryset(request.user), fieldset)
+        if KeysetPagination.is_requested(request):
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(rows, request, position=app_row_position)
+            return paginator.get_paginated_data(serialize_app_rows(page, fieldset))
+        return serialize_app_rows(rows, fieldset)
+
+    @idempotent
     def post(self, request):
         serializer = AppSerializer(data=request.data)
         if serializer.is_valid():
             app = serializer.save(user=request.user)
             
             # Automatically subscribe to free plan
-            try:
-                free_plan = Plan.objects.get(name='FREE')
-            except Plan.DoesNotExist:
-                # If the FREE plan doesn't exist, create it
-                free_plan = Plan.objects.create(name='FREE')
+            free_plan = plan_catalog.get('FREE')
             
             # Create the subscription for the new app
             Subscription.objects.create(app=app, plan=free_plan)
+            record_events([make_event(app.pk, SubscriptionEvent.CREATED, free_plan.name)])
+            response_cache.bump(request.user)
             
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class AppBulkCreateView(APIView):
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if isinstance(request.data, list) and len(request.data) > settings.APP_BULK_MAX_ITEMS:
+            return Response(
+                {'error': 'At most {} apps can be created per request'.format(settings.APP_BULK_MAX_ITEMS)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Validating through the list serializer reports errors per item.
+        serializer = AppSerializer(data=request.data, many=True)
+        if serializer.is_valid():
+            apps = bulk_create_apps(request.user, serializer.validated_data)
+            response_cache.bump(request.user)
+            return Response(AppSerializer(apps, many=True).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class AppExportView(APIView):
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format=csv names the export format here, not a DRF renderer.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        export_format = request.query_params.get('format', 'ndjson')
+        if export_format not in ENCODERS:
+            return Response(
+                {'error': 'format must be one of: {}'.format(', '.join(ENCODERS))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content_type, encode = ENCODERS[export_format]
+        content = encode(app_chunks(request.user))
+        if isinstance(request._request, ASGIRequest):
+            content = prefetch_in_thread(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="apps.{}"'.format(export_format)
+        return response
+
 class AppDetailView(APIView):
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self, user):
+        return App.objects.filter(user=user).select_related('subscription__plan')
+
     def get_object(self, pk, user):
         try:
-            return App.objects.get(pk=pk, user=user)
+            return self.get_queryset(user).get(pk=pk)
         except App.DoesNotExist:
             raise Http404
 
     def get(self, request, pk):
-        print(request.user)
-        app = self.get_object(pk, request.user)
-        serializer = AppSerializer(app)
-        return Response(serializer.data)
+        fieldset = AppFieldset.from_query_params(request.query_params)
+        etag = app_detail_etag(request.user, pk)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        data, hit = response_cache.get_or_build(
+            request, etag, lambda: self.detail_data(pk, request.user, fieldset),
+        )
+        response = Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return set_etag(response, etag)
+
+    def detail_data(self, pk, user, fieldset):
+        if fieldset is None:
+            return AppSerializer(self.get_object(pk, user)).data
+        rows = serialize_app_rows(app_rows(App.objects.filter(user=user, pk=pk), fieldset), fieldset)
+        if not rows:
+            raise Http404
+        return rows[0]
 
     def put(self, request, pk):
         app = self.get_object(pk, request.user)
         serializer = AppSerializer(app, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            response_cache.bump(request.user)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk):
         app = self.get_object(pk, request.user)
-        app.delete()        
+        if prefers_async(request):
+            # Hidden at once, purged later by manage.py purge_deleted.
+            mark_app_deleted(app)
+            response_cache.bump(request.user)
+            response = Response({'message': 'App scheduled for deletion'}, status=status.HTTP_202_ACCEPTED)
+            response['Preference-Applied'] = 'respond-async'
+            return response
+        app.delete()
+        response_cache.bump(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
     
 
 class SubscriptionUpdateView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     
+    @idempotent
     def put(self, request, pk):
         try:
             app = App.objects.get(pk=pk, user=request.user)
@@ -145,15 +260,23 @@ class SubscriptionUpdateView(APIView):
         plan_name = request.data.get('plan')
         if not plan_name in ["STANDARD", "PRO", "FREE"]:
             return Response({'error': "Plan doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            plan = Plan.objects.get(name=plan_name)
-        except Plan.DoesNotExist:
-            plan = Plan.objects.create(name=plan_name)
+        plan = plan_catalog.get(plan_name)
 
-        subscription, created = Subscription.objects.get_or_create(app=app)
+        subscription, created = Subscription.objects.get_or_create(app=app, defaults={'plan': plan})
+        events = []
+        if created:
+            events.append(make_event(app.pk, SubscriptionEvent.CREATED, plan.name))
+        elif subscription.plan_id != plan.pk:
+            previous_plan = plan_catalog.name_for(subscription.plan_id) or subscription.plan.name
+            events.append(make_event(app.pk, SubscriptionEvent.PLAN_CHANGED, plan.name, previous_plan))
+        elif not subscription.active:
+            events.append(make_event(app.pk, SubscriptionEvent.REACTIVATED, plan.name))
         subscription.plan = plan
         subscription.active = True
         subscription.save()
+        # Only once the change is saved: outside a transaction on_commit runs at once.
+        record_events(events)
+        response_cache.bump(request.user)
 
         serializer = SubscriptionSerializer(subscription)
         return Response(serializer.data)
@@ -164,7 +287,78 @@ class SubscriptionUpdateView(APIView):
         except App.DoesNotExist:
             return Response({'error': 'App not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        subscription = Subscription.objects.get(app=app)
+        subscription = Subscription.objects.select_related('plan').get(app=app)
+        was_active = subscription.active
         subscription.active = False
+        subscription.save(update_fields=['active', 'updated_at'])
+        if was_active:
+            record_events([make_event(app.pk, SubscriptionEvent.DEACTIVATED, subscription.plan.name)])
+        response_cache.bump(request.user)
         serializer = SubscriptionSerializer(subscription)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+class SubscriptionHistoryView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+
+    def get(self, request, pk):
+        if not App.objects.filter(pk=pk, user=request.user).exists():
+            return Response({'error': 'App not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Only flushed events are listed: the background flusher writes them within FLUSH_INTERVAL seconds.
+        paginator = KeysetPagination()
+        events = paginator.paginate_queryset(SubscriptionEvent.objects.filter(app_id=pk), request)
+        return Response(paginator.get_paginated_data(SubscriptionEventSerializer(events, many=True).data))
+
+class SubscriptionBulkUpdateView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+
+    def put(self, request):
+        plan_name = request.data.get('plan')
+        if plan_name not in dict(Plan.PLAN_CHOICES):
+            return Response({'error': "Plan doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Either an explicit list of app ids or "all" for every app of the user.
+        app_ids = request.data.get('apps')
+        if app_ids == 'all':
+            app_ids = None
+        elif not isinstance(app_ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in app_ids):
+            return Response({'error': 'apps must be a list of app ids or "all"'}, status=status.HTTP_400_BAD_REQUEST)
+        elif len(app_ids) > settings.APP_BULK_MAX_ITEMS:
+            return Response(
+                {'error': 'At most {} apps can be changed per request'.format(settings.APP_BULK_MAX_ITEMS)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        plan = plan_catalog.get(plan_name)
+        updated, created, not_found = bulk_change_plan(request.user, plan, app_ids)
+        response_cache.bump(request.user)
+        return Response({
+            'plan': PlanSerializer(plan).data,
+            'updated': updated,
+            'created': created,
+            'not_found': not_found,
+        })
+
+class RevenueReportView(APIView):
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('users', settings.REPORT_USER_LIMIT))
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            return Response({'error': 'users must be a non-negative integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(limit, settings.REPORT_MAX_USER_LIMIT)
+
+        plans = plan_report()
+        return Response({
+            'plans': plans,
+            'totals': {
+                'active_subscriptions': sum(plan['active_subscriptions'] for plan in plans),
+                'mrr': sum(plan['mrr'] for plan in plans),
+            },
+            'top_users': user_spend_report(limit) if limit else [],
+        })
@@ -0,0 +1,51 @@
+"""
+Process start-up warm-up.
+
+Work that every worker would otherwise repeat on its first requests: URL
+pattern compilation, view and serializer imports, DRF's lazily imported
+settings, password hashers and validators, the translation catalog and the
+plan table. backend_app.wsgi and backend_app.asgi call warm_up() at import,
+so under gunicorn's preload_app (see gunicorn.conf.py) it runs once in the
+master and the workers inherit the result.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.contrib.auth.password_validation import get_default_password_validators
+from django.urls import URLResolver, get_resolver
+from django.utils import translation
+from rest_framework.settings import api_settings
+
+from . import serializers
+from .plans import warm_plan_catalog
+
+SERIALIZERS = [
+    serializers.UserSerializer,
+    serializers.PlanSerializer,
+    serializers.SubscriptionSerializer,
+    serializers.AppSerializer,
+    serializers.SubscriptionEventSerializer,
+]
+
+
+def compile_url_patterns(patterns):
+    for pattern in patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            compile_url_patterns(pattern.url_patterns)
+
+
+def warm_up():
+    resolver = get_resolver()
+    compile_url_patterns(resolver.url_patterns)
+    resolver.reverse_dict
+    for name in ['DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_CONTENT_NEGOTIATION_CLASS']:
+        getattr(api_settings, name)
+    for serializer_class in SERIALIZERS:
+        serializer_class().fields
+    get_hashers()
+    get_default_password_validators()
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+    # Loads the plans and closes the connection, so forked workers do not
+    # share the master's database socket.
+    warm_plan_catalog()
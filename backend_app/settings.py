@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.RequestInstrumentationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +90,53 @@ DATABASES = {
     }
 }
 
+# DJANGO_DB_PROFILE=production keeps connections open between requests and
+# configures SQLite for concurrent workers: WAL journaling, a busy timeout
+# instead of immediate "database is locked" errors, and BEGIN IMMEDIATE
+# transactions (see backend_app/sqlite_backend).
+
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'default')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('DJANGO_SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'ENGINE': 'backend_app.sqlite_backend',
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 600)),
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+elif DB_PROFILE != 'default':
+    raise ImproperlyConfigured('Unknown DJANGO_DB_PROFILE {!r}'.format(DB_PROFILE))
+
+# Read replicas (api.routing): DJANGO_DB_REPLICAS is a comma-separated list of
+# SQLite files kept in sync with ``manage.py sync_replica``. Safe requests read
+# from a replica lagging at most MAX_LAG seconds that already has the client's
+# last write (write times are kept in SHARED_STATE). Heartbeats are read at most
+# once per LAG_TTL seconds.
+
+DATABASES.update(
+    ('replica_{}'.format(index), dict(DATABASES['default'], NAME=path.strip(), TEST={'MIRROR': 'default'}))
+    for index, path in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1)
+)
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+DATABASE_ROUTERS = ['api.routing.PrimaryReplicaRouter']
+
+READ_REPLICAS = {
+    'MAX_LAG': float(os.environ.get('DJANGO_REPLICA_MAX_LAG', 30)),
+    'LAG_TTL': 1,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -124,3 +178,131 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Keyset pagination for GET /app/ (enabled by passing ?cursor= or ?page_size=)
+
+APP_LIST_PAGE_SIZE = 100
+
+APP_LIST_MAX_PAGE_SIZE = 1000
+
+# Per-key timestamps shared by every worker on the host through memory-mapped
+# files named PATH-<table> (api.shared): token revocations and replica pins.
+
+SHARED_STATE = {
+    'PATH': os.environ.get('DJANGO_SHARED_STATE_PATH', os.path.join(tempfile.gettempdir(), 'api-shared-state')),
+    'SLOTS': 65536,
+}
+
+# In-process token cache used by api.authentication.CachedTokenAuthentication.
+# Revocations reach other workers through SHARED_STATE.
+
+TOKEN_CACHE_SIZE = 10000
+
+TOKEN_CACHE_TTL = 60
+
+# Largest batch accepted by POST /app/bulk/
+
+APP_BULK_MAX_ITEMS = 500
+
+# GET /app/export/ reads this many apps per query; under ASGI up to
+# APP_EXPORT_PREFETCH_CHUNKS encoded chunks are buffered ahead of the client.
+
+APP_EXPORT_CHUNK_SIZE = 2000
+
+APP_EXPORT_PREFETCH_CHUNKS = 4
+
+# Write-behind buffer of subscription history events (api.history): flushed
+# with one bulk insert at BUFFER_SIZE events and every FLUSH_INTERVAL seconds.
+
+SUBSCRIPTION_EVENTS = {
+    'BUFFER_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+}
+
+# Login attempts per client address and per username (api.throttling), checked
+# before any database lookup or password hashing. Buckets are shared by all
+# workers on the host through a memory-mapped file at PATH.
+
+LOGIN_THROTTLE = {
+    'ENABLED': os.environ.get('DJANGO_LOGIN_THROTTLE', '1') == '1',
+    'IP_RATE': os.environ.get('DJANGO_LOGIN_IP_RATE', '30/min'),
+    'USERNAME_RATE': os.environ.get('DJANGO_LOGIN_USERNAME_RATE', '5/min'),
+    'PATH': os.environ.get('DJANGO_LOGIN_THROTTLE_PATH', os.path.join(tempfile.gettempdir(), 'api-login-throttle')),
+    'SLOTS': 65536,
+}
+
+# Idempotency-Key support on POST /app/ and PUT /app/sub/<pk>/ (api.idempotency).
+# Responses are replayed for TTL seconds. A retry of a request that is still
+# running waits up to WAIT_TIMEOUT seconds for it; a claim whose request never
+# finished can be taken over after LOCK_TIMEOUT seconds.
+
+IDEMPOTENCY = {
+    'TTL': 24 * 60 * 60,
+    'LOCK_TIMEOUT': 60,
+    'WAIT_TIMEOUT': 10,
+}
+
+# Users listed by GET /reports/revenue/ (?users=N)
+
+REPORT_USER_LIMIT = 100
+
+REPORT_MAX_USER_LIMIT = 1000
+
+# Async signup/login/change_pass views for ASGI deployments (see README)
+
+ASYNC_AUTH_VIEWS = os.environ.get('DJANGO_ASYNC_AUTH_VIEWS') == '1'
+
+PASSWORD_HASHING_WORKERS = int(os.environ.get('DJANGO_PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+
+# Cache of GET /app/ and GET /app/<pk>/ responses (api.cache). ALIAS=None keeps
+# a private local-memory cache per process; set it to a CACHES alias to share
+# entries between workers.
+
+APP_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'ALIAS': None,
+    'TIMEOUT': 300,
+    'MAX_ENTRIES': 10000,
+}
+
+REST_FRAMEWORK = {
+    # Proxies in front of gunicorn; X-Forwarded-For is only trusted behind one.
+    'NUM_PROXIES': int(os.environ.get('DJANGO_NUM_PROXIES', 0)),
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Per-request SQL/serializer timing (api.middleware). Requests slower than
+# SLOW_REQUEST_MS are logged with their SLOW_QUERIES slowest queries.
+
+REQUEST_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('DJANGO_REQUEST_INSTRUMENTATION', '1') == '1',
+    'SERVER_TIMING': True,
+    'SLOW_REQUEST_MS': int(os.environ.get('DJANGO_SLOW_REQUEST_MS', 500)),
+    'SLOW_QUERIES': 5,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'api.instrumentation.JSONFormatter'},
+    },
+    'handlers': {
+        'structured': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'api.requests': {'handlers': ['structured'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Prometheus metrics at /metrics (api.metrics). Set PROMETHEUS_MULTIPROC_DIR to
+# aggregate across worker processes. TOKEN, if set, is required as a Bearer token.
+
+METRICS = {
+    'ENABLED': os.environ.get('DJANGO_METRICS', '1') == '1',
+    'TOKEN': os.environ.get('DJANGO_METRICS_TOKEN'),
+    'BUSINESS_TTL': int(os.environ.get('DJANGO_METRICS_BUSINESS_TTL', 60)),
+}
@@ -0,0 +1,35 @@
+"""
+API-only settings profile.
+
+Same as backend_app.settings without the parts a token-authenticated JSON
+API never uses: the admin, sessions, messages, static files and template
+engines, their middleware, and the browsable API renderer. Select it with
+DJANGO_SETTINGS_MODULE=backend_app.settings_api (the Dockerfile does).
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import REST_FRAMEWORK
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'rest_framework.authtoken',
+    'api'
+]
+
+# API views are csrf_exempt and nothing reads request.session or
+# request.user outside DRF's own authentication.
+MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.RequestInstrumentationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'backend_app.urls_api'
+
+TEMPLATES = []
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=['api.renderers.FastJSONRenderer'])
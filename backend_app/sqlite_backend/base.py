@@ -0,0 +1,34 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend for the production database profile.
+
+    Two extra OPTIONS keys are understood on top of the sqlite3.connect()
+    arguments:
+
+    * ``pragmas``: mapping of PRAGMA name to value, applied to every new
+      connection (journal_mode, synchronous, busy_timeout, ...).
+    * ``transaction_mode``: ``IMMEDIATE`` makes atomic blocks take the writer
+      lock up front. A deferred transaction that reads and then writes cannot
+      wait on busy_timeout when another writer got in first, and fails with
+      "database is locked" straight away.
+    """
+    extra_options = ('pragmas', 'transaction_mode')
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for option in self.extra_options:
+            kwargs.pop(option, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute('BEGIN {}'.format(mode) if mode else 'BEGIN')
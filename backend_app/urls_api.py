@@ -0,0 +1,9 @@
+"""
+URL configuration for the API-only settings profile (backend_app.settings_api):
+the API routes without the admin site.
+"""
+from django.urls import path, include
+
+urlpatterns = [
+    path('', include('api.urls'))
+]
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_app.settings')
 
 application = get_wsgi_application()
+
+from api.history import start_event_flusher  # noqa: E402
+from api.warmup import warm_up  # noqa: E402
+
+warm_up()
+start_event_flusher()
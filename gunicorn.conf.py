@@ -0,0 +1,41 @@
+import gc
+import multiprocessing
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Load Django and run api.warmup once in the master; workers are forked from
+# it ready to serve and share those pages copy-on-write.
+preload_app = True
+
+
+def on_starting(server):
+    # Metric files left over from a previous run would be added to this run's totals.
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def when_ready(server):
+    # Runs in the master before the first worker is forked. Frozen objects are
+    # left out of garbage collection, which would otherwise write to (and so
+    # copy) every page holding the preloaded modules in each worker.
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Buffered subscription history must reach the database before the worker goes.
+    from api.history import event_buffer
+    event_buffer.stop()